@@ -1,55 +1,316 @@
-import os
-import json
-import re
-import requests
-from dotenv import load_dotenv
-from google import genai
-from groq import Groq
-
-load_dotenv()
-
-gemini_key = os.getenv('GEMINI_API_KEY')
-gemini_client = genai.Client(api_key=gemini_key) if gemini_key else None
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-groq_key = os.getenv('GROQ')
-groq_client = Groq(api_key=groq_key) if groq_key else None
-GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-70b-8192")
-hf_key = os.getenv('HF_TOKEN') #nie działa//nie zdążyłem zrobić
-
-
-def clean_json_text(text: str) -> str:
-    pattern = r"^```(?:json)?\s*(.*?)\s*```$"
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return text.strip()
-
-def generate_ai_response(prompt: str, provider: str = "auto") -> str:
-    if gemini_client:
-        try:
-            print("☁️ AI: Próba Gemini...")
-            response = gemini_client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
-            return clean_json_text(response.text)
-        except Exception as e:
-            print(f"⚠️ Błąd Gemini: {e}")
-
-    if groq_client:
-        try:
-            print("⚡ AI: Próba Groq...")
-            completion = groq_client.chat.completions.create(
-                model=GROQ_MODEL,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return completion.choices[0].message.content
-        except Exception as e:
-            print(f"⚠️ Błąd Groq: {e}")
-
-
-def analyze_reviews_with_gemini(text: str) -> dict:
-    prompt = f"Przeanalizuj opinie i zwróć JSON {{'summary': '...', 'pros': '...', 'cons': '...'}}. Opinie: {text}"
-    res = generate_ai_response(prompt, provider="auto")
-    try:
-        json_match = re.search(r'(\{.*\})', res, re.DOTALL)
-        return json.loads(json_match.group(1)) if json_match else json.loads(res)
-    except:
-        return {"summary": "Błąd analizy API.", "pros": "", "cons": ""}
\ No newline at end of file
+import os
+import json
+import re
+import time
+import asyncio
+import hashlib
+import functools
+import httpx
+import concurrent.futures
+from dotenv import load_dotenv
+from llm_router import ProviderRouter
+
+load_dotenv()
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-70b-8192")
+hf_key = os.getenv('HF_TOKEN') #nie działa//nie zdążyłem zrobić
+
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_HEDGE_AFTER_S = float(os.getenv("LLM_HEDGE_AFTER_S", "0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+REVIEW_CHUNK_TOKENS = int(os.getenv("REVIEW_CHUNK_TOKENS", "3000"))
+REVIEW_MAP_PARALLELISM = int(os.getenv("REVIEW_MAP_PARALLELISM", "4"))
+REVIEW_MERGE_MAX_ROUNDS = int(os.getenv("REVIEW_MERGE_MAX_ROUNDS", "4"))
+LLM_FAKE = os.getenv("LLM_FAKE", "0") == "1"
+LLM_FAKE_LATENCY_S = float(os.getenv("LLM_FAKE_LATENCY_S", "0.8"))
+LLM_FAKE_TOKEN_S = float(os.getenv("LLM_FAKE_TOKEN_S", "0.02"))
+
+_http_limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+
+
+def clean_json_text(text: str) -> str:
+    pattern = r"^```(?:json)?\s*(.*?)\s*```$"
+    match = re.search(pattern, text, re.DOTALL)
+    if match:
+        return match.group(1).strip()
+    return text.strip()
+
+
+class LLMProvider:
+    name = "base"
+    label = ""
+
+    def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def agenerate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def astream(self, prompt: str):
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+    label = "☁️ AI: Próba Gemini..."
+
+    def __init__(self, api_key: str, model: str = GEMINI_MODEL):
+        self.api_key = api_key
+        self.model = model
+
+    @functools.cached_property
+    def client(self):
+        # SDK importujemy i tworzymy klienta przy pierwszym zapytaniu, nie przy imporcie modułu.
+        from google import genai
+        from google.genai import types
+        return genai.Client(api_key=self.api_key, http_options=types.HttpOptions(timeout=int(LLM_TIMEOUT_S * 1000)))
+
+    def generate(self, prompt: str) -> str:
+        response = self.client.models.generate_content(model=self.model, contents=prompt)
+        return clean_json_text(response.text)
+
+    async def agenerate(self, prompt: str) -> str:
+        response = await self.client.aio.models.generate_content(model=self.model, contents=prompt)
+        return clean_json_text(response.text)
+
+    async def astream(self, prompt: str):
+        async for chunk in await self.client.aio.models.generate_content_stream(model=self.model, contents=prompt):
+            if chunk.text:
+                yield chunk.text
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+    label = "⚡ AI: Próba Groq..."
+
+    def __init__(self, api_key: str, model: str = GROQ_MODEL):
+        self.api_key = api_key
+        self.model = model
+
+    @functools.cached_property
+    def client(self):
+        from groq import Groq
+        return Groq(
+            api_key=self.api_key,
+            timeout=LLM_TIMEOUT_S,
+            http_client=httpx.Client(limits=_http_limits, timeout=LLM_TIMEOUT_S),
+        )
+
+    @functools.cached_property
+    def async_client(self):
+        from groq import AsyncGroq
+        return AsyncGroq(
+            api_key=self.api_key,
+            timeout=LLM_TIMEOUT_S,
+            http_client=httpx.AsyncClient(limits=_http_limits, timeout=LLM_TIMEOUT_S),
+        )
+
+    def generate(self, prompt: str) -> str:
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return completion.choices[0].message.content
+
+    async def agenerate(self, prompt: str) -> str:
+        completion = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return completion.choices[0].message.content
+
+    async def astream(self, prompt: str):
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class FakeProvider(LLMProvider):
+    # Deterministyczna atrapa LLM do testów obciążeniowych offline (LLM_FAKE=1) - bez sieci i kluczy API.
+    name = "fake"
+    label = "🧪 AI: Atrapa LLM..."
+
+    def __init__(self, latency_s: float = LLM_FAKE_LATENCY_S, token_s: float = LLM_FAKE_TOKEN_S):
+        self.latency_s = latency_s
+        self.token_s = token_s
+
+    def reply(self, prompt: str) -> str:
+        if "'summary'" in prompt:
+            digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+            return json.dumps({"summary": f"Testowa analiza {digest}.", "pros": "Dobra cena", "cons": "Brak"},
+                              ensure_ascii=False)
+        if "WYNIK Z BAZY DANYCH" in prompt:
+            return "Oto znaleziony produkt."
+        question = prompt.rsplit("Użytkownik: ", 1)[-1].split("\n", 1)[0].strip() if "Użytkownik: " in prompt else ""
+        if question.lower().startswith(("pokaż", "znajdź", "szukam")):
+            return json.dumps({"tool": "get_product_details", "args": {"product_name": question.split(" ", 1)[-1]}},
+                              ensure_ascii=False)
+        return f"Odpowiedź testowa na: {question[:80]}"
+
+    def generate(self, prompt: str) -> str:
+        time.sleep(self.latency_s)
+        return self.reply(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        await asyncio.sleep(self.latency_s)
+        return self.reply(prompt)
+
+    async def astream(self, prompt: str):
+        await asyncio.sleep(self.latency_s)
+        for word in re.findall(r"\S+\s*", self.reply(prompt)):
+            await asyncio.sleep(self.token_s)
+            yield word
+
+
+gemini_key = os.getenv('GEMINI_API_KEY')
+groq_key = os.getenv('GROQ')
+gemini_provider = GeminiProvider(gemini_key) if gemini_key else None
+groq_provider = GroqProvider(groq_key) if groq_key else None
+
+PROVIDERS = [FakeProvider()] if LLM_FAKE else [p for p in (gemini_provider, groq_provider) if p]
+
+
+router = ProviderRouter(
+    PROVIDERS,
+    timeout=LLM_TIMEOUT_S,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    hedge_after=LLM_HEDGE_AFTER_S,
+    failure_threshold=LLM_BREAKER_FAILURES,
+    cooldown_s=LLM_BREAKER_COOLDOWN_S,
+)
+
+
+def generate_ai_response(prompt: str, provider: str = "auto") -> str:
+    return router.generate(prompt, provider=provider)
+
+
+async def agenerate_ai_response(prompt: str, provider: str = "auto") -> str:
+    return await router.agenerate(prompt, provider=provider)
+
+
+def astream_ai_response(prompt: str, provider: str = "auto"):
+    return router.astream(prompt, provider=provider)
+
+
+ANALYSIS_ERROR_SUMMARY = "Błąd analizy API."
+
+
+def _parse_analysis(res: str) -> dict:
+    try:
+        json_match = re.search(r'(\{.*\})', res, re.DOTALL)
+        return json.loads(json_match.group(1)) if json_match else json.loads(res)
+    except:
+        return {"summary": ANALYSIS_ERROR_SUMMARY, "pros": "", "cons": ""}
+
+
+def _analysis_prompt(text: str) -> str:
+    return f"Przeanalizuj opinie i zwróć JSON {{'summary': '...', 'pros': '...', 'cons': '...'}}. Opinie: {text}"
+
+
+def analyze_reviews_with_gemini(text: str) -> dict:
+    return _parse_analysis(generate_ai_response(_analysis_prompt(text), provider="auto"))
+
+
+def estimate_tokens(text: str) -> int:
+    # Przybliżenie bez tokenizera: ~4 znaki na token dla tekstu PL/EN.
+    return len(text) // 4 + 1
+
+
+def chunk_by_tokens(lines: list[str], budget: int) -> list[list[str]]:
+    chunks, current, used = [], [], 0
+    max_chars = budget * 4
+    for line in lines:
+        if len(line) > max_chars:
+            line = line[:max_chars]
+        cost = estimate_tokens(line)
+        if current and used + cost > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _is_failed(result: dict) -> bool:
+    return not isinstance(result, dict) or result.get("summary") == ANALYSIS_ERROR_SUMMARY
+
+
+def _merge_prompt(partials: list[dict]) -> str:
+    return (
+        "Połącz częściowe analizy opinii o jednym produkcie w jedną. Usuń powtórzenia, zachowaj najważniejsze "
+        "zalety i wady. Zwróć JSON {'summary': '...', 'pros': '...', 'cons': '...'}. "
+        f"Częściowe analizy: {json.dumps(partials, ensure_ascii=False)}"
+    )
+
+
+def _merge_partials(partials: list[dict], budget: int, pool, max_rounds: int = REVIEW_MERGE_MAX_ROUNDS) -> dict:
+    # Redukcja wielopoziomowa: jeśli wyniki częściowe nie mieszczą się w budżecie, łączymy je grupami.
+    # Runda bez postępu (np. wszystkie scalenia nieudane) kończy redukcję zamiast ponawiać zapytania w nieskończoność.
+    for _ in range(max_rounds):
+        if len(partials) <= 1 or estimate_tokens(json.dumps(partials, ensure_ascii=False)) <= budget:
+            break
+        groups = chunk_by_tokens([json.dumps(p, ensure_ascii=False) for p in partials], budget)
+        if len(groups) == len(partials):
+            break
+        merged = pool.map(lambda g: _parse_analysis(generate_ai_response(_merge_prompt([json.loads(x) for x in g]))), groups)
+        merged = [m for m in merged if not _is_failed(m)]
+        if not merged:
+            break
+        partials = merged
+    if len(partials) == 1:
+        return partials[0]
+    result = _parse_analysis(generate_ai_response(_merge_prompt(partials)))
+    if _is_failed(result):
+        # Lepiej najobszerniejszy wynik częściowy niż brak analizy.
+        print("⚠️ Analiza map-reduce: Scalanie nie powiodło się, zwracam największy wynik częściowy.")
+        return max(partials, key=lambda p: len(json.dumps(p, ensure_ascii=False)))
+    return result
+
+
+def summarize_reviews(price_report: str, reviews: list[str], chunk_tokens: int = REVIEW_CHUNK_TOKENS,
+                      parallelism: int = REVIEW_MAP_PARALLELISM) -> dict:
+    full_text = price_report + "\nOPINIE UŻYTKOWNIKÓW:\n" + "\n".join(reviews)
+    budget = max(chunk_tokens - estimate_tokens(price_report), chunk_tokens // 4)
+    if estimate_tokens(full_text) <= chunk_tokens:
+        return analyze_reviews_with_gemini(full_text)
+
+    chunks = chunk_by_tokens(reviews, budget)
+    print(f"🧩 Analiza map-reduce: {len(reviews)} opinii w {len(chunks)} częściach.")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="review-map") as pool:
+        partials = list(pool.map(
+            lambda chunk: analyze_reviews_with_gemini(price_report + "\nOPINIE UŻYTKOWNIKÓW:\n" + "\n".join(chunk)),
+            chunks
+        ))
+        partials = [p for p in partials if not _is_failed(p)]
+        if not partials:
+            return {"summary": ANALYSIS_ERROR_SUMMARY, "pros": "", "cons": ""}
+        return _merge_partials(partials, chunk_tokens, pool)
+
+
+def update_review_summary(previous: dict, price_report: str, new_reviews: list[str],
+                          chunk_tokens: int = REVIEW_CHUNK_TOKENS) -> dict:
+    delta_text = "\n".join(new_reviews)
+    if estimate_tokens(price_report + delta_text) > chunk_tokens:
+        delta = summarize_reviews(price_report, new_reviews, chunk_tokens)
+        if _is_failed(delta):
+            return delta
+        return _parse_analysis(generate_ai_response(_merge_prompt([previous, delta])))
+    prompt = (
+        "Oto dotychczasowa analiza opinii o produkcie oraz nowe opinie i aktualny raport cenowy. "
+        "Zaktualizuj analizę, uwzględniając nowe informacje, i zwróć JSON "
+        "{'summary': '...', 'pros': '...', 'cons': '...'}. "
+        f"Dotychczasowa analiza: {json.dumps(previous, ensure_ascii=False)}\n{price_report}\n"
+        f"NOWE OPINIE:\n{delta_text}"
+    )
+    return _parse_analysis(generate_ai_response(prompt))
@@ -0,0 +1,327 @@
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy import func, or_
+from sqlmodel import Session, select
+from database import engine
+from models import Product, Review, Offer, Insight, AnalysisStatus
+from scraper import scrape_product_deep
+from review_dedup import dedupe_reviews, normalize_review
+from ai_service import summarize_reviews, update_review_summary, ANALYSIS_ERROR_SUMMARY
+
+insight_listeners = []
+
+
+def on_insight_updated(callback):
+    insight_listeners.append(callback)
+    return callback
+
+
+@dataclass
+class AnalysisInputs:
+    price_report: str
+    reviews: list[tuple[int, str]]
+    fingerprint: str
+    last_offer_id: int | None = None
+
+    @property
+    def review_lines(self) -> list[str]:
+        return [line for _, line in self.reviews]
+
+    @property
+    def last_review_id(self) -> int | None:
+        return max((rid for rid, _ in self.reviews), default=None)
+
+
+def fingerprint_inputs(offers: list[Offer], reviews: list[Review]) -> str:
+    digest = hashlib.sha256()
+    for o in sorted(offers, key=lambda o: o.id or 0):
+        digest.update(f"O|{o.store_name}|{o.price}|{o.link}\n".encode("utf-8"))
+    for r in sorted(reviews, key=lambda r: r.id or 0):
+        digest.update(f"R|{r.id}|{r.rating}|{r.duplicates}|{r.content}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def review_line(r: Review) -> str:
+    repeated = f" (powtórzone {r.duplicates}x)" if r.duplicates and r.duplicates > 1 else ""
+    return f"- (Ocena: {r.rating}/5){repeated} {r.content}"
+
+
+def load_analysis_inputs(session: Session, product_id: int) -> AnalysisInputs | None:
+    reviews = session.exec(select(Review).where(Review.product_id == product_id).order_by(Review.id)).all()
+    offers = session.exec(select(Offer).where(Offer.product_id == product_id)).all()
+    if not reviews and not offers:
+        return None
+
+    price_report = "RAPORT CENOWY:\n"
+    for o in offers:
+        price_report += f"- Sklep: {o.store_name}, Cena: {o.price} zł\n"
+    return AnalysisInputs(
+        price_report=price_report,
+        reviews=[(r.id, review_line(r)) for r in reviews],
+        fingerprint=fingerprint_inputs(offers, reviews),
+        last_offer_id=max((o.id for o in offers), default=None),
+    )
+
+
+def store_input_stats(insight: Insight, inputs: AnalysisInputs):
+    # Te same agregaty liczy find_stale_insights w SQL - zgodność oznacza brak nowych danych.
+    insight.input_hash = inputs.fingerprint
+    insight.last_review_id = inputs.last_review_id
+    insight.review_count = len(inputs.reviews)
+    insight.last_offer_id = inputs.last_offer_id
+
+
+def set_insight_status(product_id: int, status: AnalysisStatus):
+    with Session(engine) as session:
+        insight = session.exec(select(Insight).where(Insight.product_id == product_id)).first()
+        if not insight:
+            insight = Insight(product_id=product_id)
+        insight.status = status
+        session.add(insight)
+        session.commit()
+
+
+def save_insight(product_id: int, result: dict | None, inputs: AnalysisInputs | None = None):
+    with Session(engine) as session:
+        insight = session.exec(select(Insight).where(Insight.product_id == product_id)).first()
+        if not insight:
+            insight = Insight(product_id=product_id)
+        if result is None:
+            insight.status = AnalysisStatus.ERROR
+        else:
+            insight.summary = result.get("summary", "Brak podsumowania")
+            insight.pros = result.get("pros", "Brak")
+            insight.cons = result.get("cons", "Brak")
+            insight.status = AnalysisStatus.COMPLETED
+            insight.updated_at = datetime.utcnow()
+            if inputs is not None:
+                store_input_stats(insight, inputs)
+        session.add(insight)
+        session.commit()
+        product = session.get(Product, product_id)
+        if product:
+            for callback in insight_listeners:
+                callback(product)
+
+
+def mark_analysis_failed(product_id: int):
+    # Nieudane odświeżenie nie kasuje poprzedniej analizy: błąd zostaje w zadaniu, a produkt wraca do kolejnych odświeżeń.
+    with Session(engine) as session:
+        insight = session.exec(select(Insight).where(Insight.product_id == product_id)).first()
+        if insight and insight.summary is not None:
+            insight.status = AnalysisStatus.COMPLETED
+            session.add(insight)
+            session.commit()
+            return
+    save_insight(product_id, None)
+
+
+def run_ai_analysis(product_id: int, refresh: bool = False):
+    with Session(engine) as session:
+        inputs = load_analysis_inputs(session, product_id)
+    if inputs is None:
+        return
+    if not refresh:
+        set_insight_status(product_id, AnalysisStatus.PROCESSING)
+    result = summarize_reviews(inputs.price_report, inputs.review_lines)
+    if result.get("summary") == ANALYSIS_ERROR_SUMMARY:
+        raise RuntimeError("Analiza AI nie powiodła się.")
+    save_insight(product_id, result, inputs)
+
+
+def run_incremental_analysis(product_id: int):
+    # Do modelu trafia tylko poprzednie podsumowanie i opinie dodane od ostatniej analizy.
+    with Session(engine) as session:
+        insight = session.exec(select(Insight).where(Insight.product_id == product_id)).first()
+        inputs = load_analysis_inputs(session, product_id)
+    if inputs is None:
+        return
+    if insight and insight.input_hash == inputs.fingerprint:
+        # Bez zmian w treści (np. analiza sprzed zapisywania agregatów) - tylko zapamiętujemy stan wejść.
+        with Session(engine) as session:
+            insight = session.exec(select(Insight).where(Insight.product_id == product_id)).first()
+            store_input_stats(insight, inputs)
+            session.add(insight)
+            session.commit()
+        return
+    if not insight or insight.status != AnalysisStatus.COMPLETED or insight.last_review_id is None:
+        return run_ai_analysis(product_id)
+
+    new_reviews = [line for rid, line in inputs.reviews if rid > insight.last_review_id]
+    if not new_reviews:
+        # Zmieniły się oferty albo treść starych opinii - delta nie wystarczy.
+        return run_ai_analysis(product_id, refresh=True)
+    previous = {"summary": insight.summary, "pros": insight.pros, "cons": insight.cons}
+    print(f"♻️ Odświeżanie analizy produktu {product_id}: {len(new_reviews)} nowych opinii.")
+    result = update_review_summary(previous, inputs.price_report, new_reviews)
+    if result.get("summary") == ANALYSIS_ERROR_SUMMARY:
+        raise RuntimeError("Aktualizacja analizy AI nie powiodła się.")
+    save_insight(product_id, result, inputs)
+
+
+def find_stale_insights(after_id: int = 0, limit: int = 100) -> tuple[list[tuple[int, str]], int]:
+    # Jedno zapytanie z agregatami zamiast wczytywania opinii i ofert każdego produktu - opinie i oferty tylko
+    # dochodzą (nowe id), więc zmiana max(id) albo liczby opinii wystarcza, a pełny odcisk liczy dopiero zadanie.
+    reviews = (select(Review.product_id, func.max(Review.id).label("last_id"), func.count(Review.id).label("total"))
+               .group_by(Review.product_id).subquery())
+    offers = select(Offer.product_id, func.max(Offer.id).label("last_id")).group_by(Offer.product_id).subquery()
+    with Session(engine) as session:
+        rows = session.exec(
+            select(Product.id, Product.name)
+            .join(Insight, Insight.product_id == Product.id)
+            .outerjoin(reviews, reviews.c.product_id == Product.id)
+            .outerjoin(offers, offers.c.product_id == Product.id)
+            .where(Insight.status == AnalysisStatus.COMPLETED)
+            .where(Product.id > after_id)
+            .where(or_(
+                func.coalesce(reviews.c.total, 0) != Insight.review_count,
+                func.coalesce(reviews.c.last_id, 0) != func.coalesce(Insight.last_review_id, 0),
+                func.coalesce(offers.c.last_id, 0) != func.coalesce(Insight.last_offer_id, 0),
+            ))
+            .order_by(Product.id)
+            .limit(limit)
+        ).all()
+    return [(pid, name) for pid, name in rows], (rows[-1][0] if len(rows) == limit else 0)
+
+
+def backfill_input_stats(batch: int = 100) -> int:
+    # Jednorazowa migracja analiz sprzed zapisywania agregatów: uzupełniamy je z bieżących danych zamiast
+    # traktować NULL jako nieaktualne (co wysłałoby wszystkie stare analizy ponownie do LLM).
+    filled, cursor = 0, 0
+    while True:
+        with Session(engine) as session:
+            insights = session.exec(
+                select(Insight)
+                .where(Insight.status == AnalysisStatus.COMPLETED)
+                .where(Insight.review_count.is_(None))
+                .where(Insight.id > cursor)
+                .order_by(Insight.id)
+                .limit(batch)
+            ).all()
+            for insight in insights:
+                inputs = load_analysis_inputs(session, insight.product_id)
+                if inputs is None:
+                    insight.review_count = 0
+                elif insight.input_hash and insight.input_hash != inputs.fingerprint:
+                    # Dane zmieniły się od analizy - zostawiamy stary last_review_id, żeby nowe opinie nadal wykryć.
+                    insight.review_count = len(inputs.reviews)
+                    insight.last_offer_id = inputs.last_offer_id
+                else:
+                    store_input_stats(insight, inputs)
+                session.add(insight)
+            if not insights:
+                break
+            filled += len(insights)
+            cursor = insights[-1].id
+            session.commit()
+    if filled:
+        print(f"🛠️ Baza: Uzupełniono agregaty wejść dla {filled} analiz.")
+    return filled
+
+
+def find_outdated_products(older_than: datetime, limit: int = 100) -> list[tuple[int, str]]:
+    # Najdawniej pobrane najpierw (produkty sprzed zapisywania scraped_at na początku).
+    with Session(engine) as session:
+        return session.exec(
+            select(Product.id, Product.name)
+            .join(Insight, Insight.product_id == Product.id)
+            .where(Insight.status == AnalysisStatus.COMPLETED)
+            .where(or_(Product.scraped_at.is_(None), Product.scraped_at < older_than))
+            .order_by(Product.scraped_at.is_not(None), Product.scraped_at, Product.id)
+            .limit(limit)
+        ).all()
+
+
+def _offer_price(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def refresh_product_data(product_id: int) -> tuple[int, bool]:
+    # Ponowne pobranie istniejącego produktu: nowe opinie są dopisywane (delta dla analizy przyrostowej),
+    # a oferty podmieniane tylko wtedy, gdy faktycznie się zmieniły.
+    with Session(engine) as session:
+        product = session.get(Product, product_id)
+        if not product:
+            return 0, False
+        name, price = product.name, product.price
+        link = next((o.link for o in session.exec(select(Offer).where(Offer.product_id == product_id)) if o.link), None)
+
+    data = scrape_product_deep(name, price, link)
+    reviews = dedupe_reviews(data.get("reviews", []))
+    with Session(engine) as db:
+        known = {normalize_review(c) for c in db.exec(select(Review.content).where(Review.product_id == product_id))}
+        new_reviews = [r for r in reviews if normalize_review(r["content"]) not in known]
+        for rev in new_reviews:
+            db.add(Review(
+                product_id=product_id,
+                content=rev["content"],
+                rating=rev["rating"],
+                source=rev.get("source", "unknown"),
+                duplicates=rev.get("duplicates", 1)
+            ))
+
+        offers = db.exec(select(Offer).where(Offer.product_id == product_id)).all()
+        fresh = sorted((o["store"], _offer_price(o["price"]), o["link"]) for o in data.get("offers", []))
+        offers_changed = bool(fresh) and fresh != sorted((o.store_name, o.price, o.link) for o in offers)
+        if offers_changed:
+            for offer in offers:
+                db.delete(offer)
+            for store, offer_price, offer_link in fresh:
+                db.add(Offer(product_id=product_id, store_name=store, price=offer_price, link=offer_link))
+
+        product = db.get(Product, product_id)
+        product.scraped_at = datetime.utcnow()
+        db.add(product)
+        db.commit()
+    if new_reviews or offers_changed:
+        print(f"🔄 Produkt {product_id}: {len(new_reviews)} nowych opinii, oferty zmienione: {offers_changed}.")
+    return len(new_reviews), offers_changed
+
+
+def ingest_product(name: str, price: float, image_url: str, link: str) -> int:
+    with Session(engine) as session:
+        existing = session.exec(select(Product.id).where(Product.name == name)).first()
+        if existing:
+            return existing
+
+    data = scrape_product_deep(name, price, link)
+    data["reviews"] = dedupe_reviews(data.get("reviews", []))
+    try:
+        price_val = float(data["price"])
+    except:
+        price_val = 0.0
+    final_image = data.get("image_url") if data.get("image_url") else image_url
+    with Session(engine) as db:
+        new_product = Product(
+            name=data["name"],
+            price=price_val,
+            image_url=final_image,
+            scraped_at=datetime.utcnow()
+        )
+        db.add(new_product)
+        db.flush()
+
+        for off in data.get("offers", []):
+            db.add(Offer(
+                product_id=new_product.id,
+                store_name=off["store"],
+                price=off["price"],
+                link=off["link"]
+            ))
+
+        for rev in data.get("reviews", []):
+            db.add(Review(
+                product_id=new_product.id,
+                content=rev["content"],
+                rating=rev["rating"],
+                source=rev.get("source", "unknown"),
+                duplicates=rev.get("duplicates", 1)
+            ))
+
+        db.add(Insight(product_id=new_product.id, status=AnalysisStatus.PROCESSING))
+        db.commit()
+        return new_product.id
@@ -0,0 +1,113 @@
+import time
+import random
+import argparse
+import threading
+import numpy as np
+from embeddings import EmbeddingBatcher, create_backend
+
+WORDS = ("czy", "ten", "laptop", "ma", "dobrą", "baterię", "jaka", "jest", "cena", "słuchawek", "gwarancja",
+         "zwrot", "produktu", "w", "sklepie", "opinie", "o", "ekranie", "dostawa", "jak", "długo", "trwa")
+
+
+def make_queries(n: int, seed: int = 0) -> list[str]:
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 14))) + "?" for _ in range(n)]
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float]:
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def single_latency(backend, queries: list[str]) -> list[float]:
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        backend.encode([q])
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def batch_throughput(backend, queries: list[str], batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        backend.encode(queries[i:i + batch_size])
+    return len(queries) / (time.perf_counter() - start)
+
+
+def concurrent_run(encode, queries: list[str], workers: int) -> tuple[float, list[float]]:
+    # Równoległe żądania /chat: każdy wątek koduje swoje pojedyncze zapytanie.
+    latencies, lock = [], threading.Lock()
+    chunks = [queries[i::workers] for i in range(workers)]
+
+    def worker(items):
+        for q in items:
+            start = time.perf_counter()
+            encode([q])
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in chunks]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(queries) / (time.perf_counter() - start), latencies
+
+
+def agreement(reference: np.ndarray, vectors: np.ndarray) -> float:
+    # Średnie podobieństwo cosinusowe do pierwszego backendu - ile precyzji traci np. kwantyzacja int8.
+    if reference.shape != vectors.shape:
+        return float("nan")
+    a = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    b = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return float(np.mean(np.sum(a * b, axis=1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Opóźnienie i przepustowość backendów embeddingów.")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--batch", type=int, default=32, help="Rozmiar paczki przy indeksowaniu")
+    parser.add_argument("--workers", type=int, default=16, help="Równoległe zapytania")
+    parser.add_argument("--wait-ms", type=float, default=2.0, help="Okno zbierania mikro-batchera")
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries)
+    sample = queries[:64]
+    reference = None
+    rows = []
+    for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        try:
+            start = time.perf_counter()
+            backend = create_backend(name)
+            load_s = time.perf_counter() - start
+        except Exception as e:
+            print(f"⚠️ Pomijam {name}: {e}")
+            continue
+        backend.encode(sample[:8])  # rozgrzewka
+
+        vectors = backend.encode(sample)
+        if reference is None:
+            reference = vectors
+        single = single_latency(backend, queries)
+        throughput = batch_throughput(backend, queries, args.batch)
+        plain_qps, plain_lat = concurrent_run(backend.encode, queries, args.workers)
+        batcher = EmbeddingBatcher(backend, max_batch=args.batch, max_wait_ms=args.wait_ms)
+        batched_qps, batched_lat = concurrent_run(batcher.encode, queries, args.workers)
+        avg_batch = batcher.items / max(1, batcher.batches)
+        rows.append((name, load_s, single, throughput, plain_qps, plain_lat, batched_qps, batched_lat, avg_batch,
+                     agreement(reference, vectors)))
+
+    print(f"zapytań={args.queries} paczka={args.batch} wątków={args.workers} okno={args.wait_ms}ms")
+    print(f"{'backend':>10} | {'start s':>7} | {'1x p50':>7} | {'1x p99':>7} | {'paczka/s':>8} | "
+          f"{'równ. q/s':>9} | {'p99 ms':>7} | {'batch q/s':>9} | {'p99 ms':>7} | {'śr. batch':>9} | {'cos':>5}")
+    for name, load_s, single, throughput, plain_qps, plain_lat, batched_qps, batched_lat, avg_batch, cos in rows:
+        p50, p99 = percentiles(single)
+        print(f"{name:>10} | {load_s:>7.1f} | {p50:>7.2f} | {p99:>7.2f} | {throughput:>8.0f} | "
+              f"{plain_qps:>9.0f} | {percentiles(plain_lat)[1]:>7.2f} | {batched_qps:>9.0f} | "
+              f"{percentiles(batched_lat)[1]:>7.2f} | {avg_batch:>9.1f} | {cos:>5.3f}")
+
+
+if __name__ == "__main__":
+    main()
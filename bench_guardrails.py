@@ -0,0 +1,108 @@
+import re
+import time
+import random
+import argparse
+from security import SecurityGuard
+
+WORDS = ("produkt", "cena", "bateria", "ekran", "opinie", "zalety", "wady", "oferta", "sklep", "dostawa",
+         "słuchawki", "laptop", "gwarancja", "polecam", "jakość", "dźwięk")
+
+
+def make_llm_output(chars: int, secrets: bool, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    words, size = [], 0
+    while size < chars:
+        word = rnd.choice(WORDS)
+        if secrets and rnd.random() < 0.002:
+            word = "postgres://user:haslo@db:5432/praicer" if rnd.random() < 0.5 else "AIza" + "x" * 35
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def legacy_leakage(guard: SecurityGuard, text: str) -> bool:
+    text_lower = text.lower()
+    return any(p.lower() in text_lower for p in guard.forbidden_phrases)
+
+
+def legacy_sanitize(guard: SecurityGuard, text: str) -> str:
+    for pattern in guard.secret_patterns:
+        text = re.sub(pattern, "[REDACTED_SECRET]", text)
+    return text
+
+
+def legacy_request(guard: SecurityGuard, text: str) -> tuple[bool, str]:
+    # Dawna ścieżka /chat: osobno wykrycie wycieku, sanityzacja i druga sanityzacja gotowej odpowiedzi.
+    if legacy_leakage(guard, text):
+        return True, ""
+    text = legacy_sanitize(guard, text)
+    return False, legacy_sanitize(guard, text)
+
+
+class LegacyStream:
+    # Dawny StreamGuard: doklejanie do atrybutu i skanowanie okna z końca całego tekstu.
+    def __init__(self, guard: SecurityGuard, hold: int = 64):
+        self.guard = guard
+        self.hold = hold
+        self.text = ""
+        self.output = ""
+        self.buffer = ""
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        if legacy_leakage(self.guard, self.text[-(len(chunk) + self.hold):]):
+            return
+        self.buffer += chunk
+        cut = len(self.buffer) - self.hold
+        if cut <= 0:
+            return
+        boundary = max(self.buffer.rfind(" ", 0, cut), self.buffer.rfind("\n", 0, cut)) + 1 or cut
+        self.output += legacy_sanitize(self.guard, self.buffer[:boundary])
+        self.buffer = self.buffer[boundary:]
+
+
+def legacy_stream(guard: SecurityGuard, text: str, chunk: int) -> None:
+    stream = LegacyStream(guard)
+    for i in range(0, len(text), chunk):
+        stream.feed(text[i:i + chunk])
+
+
+def engine_stream(guard: SecurityGuard, text: str, chunk: int) -> None:
+    stream = guard.stream()
+    for i in range(0, len(text), chunk):
+        stream.feed(text[i:i + chunk])
+    stream.flush()
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mikrobenchmark guardrails na długich odpowiedziach LLM.")
+    parser.add_argument("--sizes", default="2000,20000,200000", help="Długości odpowiedzi w znakach")
+    parser.add_argument("--chunk", type=int, default=16, help="Rozmiar tokenu w trybie strumieniowym")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    guard = SecurityGuard()
+    print(f"{'znaki':>8} | {'legacy ms':>10} | {'engine ms':>10} | {'stream legacy':>13} | {'stream engine':>13}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        text = make_llm_output(size, secrets=True)
+        assert legacy_request(guard, text) == guard.scan_output(text)
+        row = [
+            timeit(lambda: legacy_request(guard, text), args.repeat),
+            timeit(lambda: guard.scan_output(text), args.repeat),
+            timeit(lambda: legacy_stream(guard, text, args.chunk), max(1, args.repeat // 4)),
+            timeit(lambda: engine_stream(guard, text, args.chunk), max(1, args.repeat // 4)),
+        ]
+        print(f"{size:>8} | {row[0]:>10.3f} | {row[1]:>10.3f} | {row[2]:>13.3f} | {row[3]:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
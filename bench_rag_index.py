@@ -0,0 +1,83 @@
+import time
+import argparse
+import numpy as np
+from dataclasses import replace
+from vector_index import IndexConfig, build_index, configure_search, prepare_vectors
+
+
+def make_corpus(n: int, dimension: int, clusters: int, spread: float, seed: int = 0, intrinsic: int = 24) -> np.ndarray:
+    # Wektory skupione wokół tematów i o niskim wymiarze wewnętrznym, jak embeddingi fragmentów regulaminów/FAQ.
+    # Izotropowy szum w 384 wymiarach daje niemal równoodległych sąsiadów i zaniżony obraz ANN.
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dimension)).astype("float32")
+    basis = rng.normal(size=(intrinsic, dimension)).astype("float32") / np.sqrt(intrinsic)
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, clusters, size=n)
+    local = spread * rng.normal(size=(n, intrinsic)).astype("float32") @ basis
+    return (centers[labels] + local + 0.05 * rng.normal(size=(n, dimension))).astype("float32")
+
+
+def search_latencies(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, list[float]]:
+    ids, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, found = index.search(q.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        ids.append(found[0])
+    return np.array(ids), latencies
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall i opóźnienie indeksów FAISS względem płaskiego indeksu.")
+    parser.add_argument("--n", type=int, default=200000, help="Liczba fragmentów")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--spread", type=float, default=1.0, help="Rozrzut wewnątrz tematu (większy = trudniej)")
+    parser.add_argument("--metric", default="cosine", choices=["l2", "ip", "cosine"])
+    parser.add_argument("--nprobe", default="4,16,64", help="Wartości nprobe dla IVF")
+    parser.add_argument("--ef-search", default="32,64,128", help="Wartości efSearch dla HNSW")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.n, args.dim, args.clusters, args.spread)
+    queries = make_corpus(args.queries, args.dim, args.clusters, args.spread, seed=1)
+    base = IndexConfig(metric=args.metric)
+
+    def build(config: IndexConfig):
+        start = time.perf_counter()
+        index, resolved = build_index(corpus, args.dim, config)
+        return index, resolved, time.perf_counter() - start
+
+    flat, flat_config, flat_build = build(replace(base, kind="flat"))
+    prepared = prepare_vectors(queries, flat_config)
+    truth, flat_lat = search_latencies(flat, prepared, args.k)
+
+    rows = [("flat", "-", flat_build, 1.0, flat_lat)]
+    ivf, ivf_config, ivf_build = build(replace(base, kind="ivf"))
+    for nprobe in [int(v) for v in args.nprobe.split(",")]:
+        config = replace(ivf_config, nprobe=min(nprobe, ivf_config.nlist))
+        configure_search(ivf, config)
+        found, lat = search_latencies(ivf, prepared, args.k)
+        rows.append((f"ivf{ivf_config.nlist}", f"nprobe={config.nprobe}", ivf_build, recall_at_k(found, truth), lat))
+
+    hnsw, hnsw_config, hnsw_build = build(replace(base, kind="hnsw"))
+    for ef in [int(v) for v in args.ef_search.split(",")]:
+        config = replace(hnsw_config, ef_search=ef)
+        configure_search(hnsw, config)
+        found, lat = search_latencies(hnsw, prepared, args.k)
+        rows.append((f"hnsw{hnsw_config.hnsw_m}", f"efSearch={ef}", hnsw_build, recall_at_k(found, truth), lat))
+
+    print(f"n={args.n} dim={args.dim} metric={args.metric} k={args.k} zapytań={args.queries}")
+    print(f"{'indeks':>10} | {'parametry':>12} | {'budowa s':>9} | {f'recall@{args.k}':>9} | {'p50 ms':>7} | {'p99 ms':>7}")
+    for name, params, build_s, recall, lat in rows:
+        p50, p99 = np.percentile(lat, 50) * 1000, np.percentile(lat, 99) * 1000
+        print(f"{name:>10} | {params:>12} | {build_s:>9.1f} | {recall:>9.3f} | {p50:>7.2f} | {p99:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
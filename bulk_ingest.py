@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+from datetime import datetime
+from sqlalchemy import insert, update
+from sqlmodel import select
+from database import engine
+from models import Product, Offer, Review, Insight, AnalysisStatus
+from scraper import scrape_product_deep
+from review_dedup import dedupe_reviews
+
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+BULK_RATE_PER_S = float(os.getenv("BULK_RATE_PER_S", "5"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+
+
+class RateLimiter:
+    def __init__(self, rate_per_s: float):
+        self.interval = 1.0 / rate_per_s if rate_per_s > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _price(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def scrape_many(items: list[dict], concurrency: int = BULK_CONCURRENCY, rate_per_s: float = BULK_RATE_PER_S) -> tuple[list, list]:
+    limiter = RateLimiter(rate_per_s)
+
+    def scrape(item):
+        limiter.acquire()
+        data = scrape_product_deep(item["name"], item["price"], item["link"])
+        data["reviews"] = dedupe_reviews(data.get("reviews", []))
+        if not data.get("image_url"):
+            data["image_url"] = item.get("image_url")
+        data["input_name"] = item["name"]
+        return data
+
+    scraped, failed = [], []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-scrape") as pool:
+        futures = {pool.submit(scrape, item): item for item in items}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                scraped.append(future.result())
+            except Exception as e:
+                failed.append({"name": futures[future]["name"], "error": str(e)})
+    return scraped, failed
+
+
+def write_batch(batch: list[dict]) -> list[dict]:
+    # Jedna transakcja na paczkę: executemany / insertmanyvalues zamiast pojedynczych db.add.
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        # Id w kolejności paczki, nie po nazwie - dwa produkty o tej samej nazwie po scrapowaniu się nie nadpisują.
+        rows = conn.execute(
+            insert(Product).returning(Product.id, sort_by_parameter_order=True),
+            [{"name": d["name"], "price": _price(d.get("price")), "image_url": d.get("image_url"), "scraped_at": now}
+             for d in batch]
+        ).all()
+        ids = [pid for pid, in rows]
+
+        offers = [
+            {"product_id": pid, "store_name": o.get("store"), "price": _price(o.get("price")), "link": o.get("link")}
+            for pid, d in zip(ids, batch) for o in d.get("offers", [])
+        ]
+        reviews = [
+            {"product_id": pid, "content": r["content"], "rating": r.get("rating", 0.0),
+             "source": r.get("source", "unknown"), "duplicates": r.get("duplicates", 1)}
+            for pid, d in zip(ids, batch) for r in d.get("reviews", [])
+        ]
+        if offers:
+            conn.execute(insert(Offer), offers)
+        if reviews:
+            conn.execute(insert(Review), reviews)
+        # Status "processing" dopiero przy zleceniu analizy - import bez --analyze nie zostawia wiecznie trwających analiz.
+        conn.execute(insert(Insight), [
+            {"product_id": pid, "status": AnalysisStatus.NONE, "updated_at": now} for pid in ids
+        ])
+    return [{"id": pid, "name": d["name"], "input_name": d.get("input_name", d["name"])} for pid, d in zip(ids, batch)]
+
+
+def ingest_products(items: list[dict], concurrency: int = BULK_CONCURRENCY, rate_per_s: float = BULK_RATE_PER_S,
+                    batch_size: int = BULK_BATCH_SIZE) -> dict:
+    started = time.perf_counter()
+    unique = list({item["name"]: item for item in items}.values())
+    names = [item["name"] for item in unique]
+    with engine.connect() as conn:
+        existing = {}
+        for i in range(0, len(names), batch_size):
+            existing.update((name, pid) for pid, name in conn.execute(
+                select(Product.id, Product.name).where(Product.name.in_(names[i:i + batch_size]))))
+    todo = [item for item in unique if item["name"] not in existing]
+
+    scraped, failed = scrape_many(todo, concurrency, rate_per_s)
+    scraped_at = time.perf_counter()
+
+    products = []
+    for i in range(0, len(scraped), batch_size):
+        products.extend(write_batch(scraped[i:i + batch_size]))
+    finished = time.perf_counter()
+
+    # Wynik dla każdej pozycji wejścia (po indeksie), także dla powtórzeń i produktów już obecnych w bazie.
+    inserted = {p["input_name"]: p["id"] for p in products}
+    errors = {f["name"]: f["error"] for f in failed}
+    results = []
+    for index, item in enumerate(items):
+        name = item["name"]
+        status = "existing" if name in existing else "inserted" if name in inserted else "failed"
+        results.append({"index": index, "name": name, "id": existing.get(name) or inserted.get(name),
+                        "status": status, "error": errors.get(name)})
+    total_s = finished - started
+    return {
+        "requested": len(items),
+        "skipped_existing": len(existing),
+        "inserted": len(products),
+        "failed": failed,
+        "offers": sum(len(d.get("offers", [])) for d in scraped),
+        "reviews": sum(len(d.get("reviews", [])) for d in scraped),
+        "scrape_s": round(scraped_at - started, 3),
+        "write_s": round(finished - scraped_at, 3),
+        "total_s": round(total_s, 3),
+        "products_per_s": round(len(products) / total_s, 2) if total_s else None,
+        "products": products,
+        "results": results,
+    }
+
+
+def enqueue_analysis(products: list[dict]) -> list[int]:
+    from jobs import job_queue, analysis_job_key
+    if not products:
+        return []
+    with engine.begin() as conn:
+        conn.execute(
+            update(Insight)
+            .where(Insight.product_id.in_([p["id"] for p in products]))
+            .where(Insight.status == AnalysisStatus.NONE)
+            .values(status=AnalysisStatus.PROCESSING)
+        )
+    return [
+        job_queue.submit(analysis_job_key(p["name"]), {"product_id": p["id"]}, product_id=p["id"])[0]
+        for p in products
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Masowy import produktów (JSON lub JSONL z polami name, price, image_url, link).")
+    parser.add_argument("path", help="Plik z listą produktów, '-' dla stdin")
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=BULK_RATE_PER_S, help="Maks. zapytań do SerpApi na sekundę")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--analyze", action="store_true", help="Uruchom analizę AI dla nowych produktów")
+    args = parser.parse_args()
+
+    raw = sys.stdin.read() if args.path == "-" else open(args.path, encoding="utf-8").read()
+    raw = raw.strip()
+    items = json.loads(raw) if raw.startswith("[") else [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+    from database import create_db_and_tables
+    create_db_and_tables()
+    stats = ingest_products(items, args.concurrency, args.rate, args.batch_size)
+    print(json.dumps({k: v for k, v in stats.items() if k not in ("products", "results")}, ensure_ascii=False, indent=2))
+
+    if args.analyze and stats["products"]:
+        from jobs import job_queue
+        enqueue_analysis(stats["products"])
+        print(f"🧠 Analiza AI dla {len(stats['products'])} produktów...")
+        job_queue.pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    main()
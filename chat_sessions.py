@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+from dotenv import load_dotenv
+from database import engine
+from models import ChatSessionRecord
+
+load_dotenv()
+
+CHAT_SESSION_LIMIT = int(os.getenv("CHAT_SESSION_LIMIT", "1000"))
+CHAT_SESSION_TTL_S = float(os.getenv("CHAT_SESSION_TTL_S", "3600"))
+CHAT_SESSION_MAX_MESSAGES = int(os.getenv("CHAT_SESSION_MAX_MESSAGES", "200"))
+
+
+@dataclass
+class ChatMessage:
+    role: str
+    content: str
+
+
+@dataclass
+class ChatSession:
+    id: str
+    messages: list = field(default_factory=list)
+    active_product_name: str | None = None
+    # Skompaktowane linie historii (klucz: pozycja + tryb kompaktowania) - nie liczymy ich od nowa w każdej turze.
+    compacted: dict = field(default_factory=dict)
+    offset: int = 0
+    version: int = 0
+
+    def append(self, role: str, content: str, max_messages: int = CHAT_SESSION_MAX_MESSAGES):
+        self.messages.append(ChatMessage(role, content))
+        overflow = len(self.messages) - max_messages
+        if overflow > 0:
+            del self.messages[:overflow]
+            self.offset += overflow
+            self.compacted = {k: v for k, v in self.compacted.items() if k[0] >= self.offset}
+
+
+class ChatSessionExpired(Exception):
+    pass
+
+
+class ChatSessionStore:
+    # Sesje w bazie - kolejne tury trafiają do dowolnego workera uvicorna. Lokalnie trzymamy tylko ostatnio
+    # używane obiekty (ze skompaktowaną historią), ważne dopóki wersja w bazie się nie zmieni.
+    def __init__(self, max_sessions: int = CHAT_SESSION_LIMIT, ttl: float = CHAT_SESSION_TTL_S):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions: OrderedDict[str, ChatSession] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    def _remember(self, session: ChatSession):
+        with self.lock:
+            self.sessions[session.id] = session
+            self.sessions.move_to_end(session.id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def get(self, session_id: str | None) -> ChatSession | None:
+        if not session_id:
+            return None
+        with Session(engine) as db:
+            record = db.get(ChatSessionRecord, session_id)
+            if record is None:
+                return None
+            if record.updated_at < self._cutoff():
+                db.delete(record)
+                db.commit()
+                with self.lock:
+                    self.sessions.pop(session_id, None)
+                raise ChatSessionExpired(session_id)
+        with self.lock:
+            cached = self.sessions.get(session_id)
+        if cached is not None and cached.version == record.version:
+            self._remember(cached)
+            return cached
+        session = ChatSession(
+            id=record.id,
+            messages=[ChatMessage(m["role"], m["content"]) for m in json.loads(record.messages)],
+            active_product_name=record.active_product_name,
+            offset=record.offset,
+            version=record.version,
+            # Pozycje w historii są bezwzględne, więc skompaktowane linie z poprzedniej wersji nadal pasują.
+            compacted={k: v for k, v in (cached.compacted if cached else {}).items() if k[0] >= record.offset},
+        )
+        self._remember(session)
+        return session
+
+    def create(self) -> ChatSession:
+        session = ChatSession(id=uuid.uuid4().hex)
+        with Session(engine) as db:
+            db.exec(delete(ChatSessionRecord).where(ChatSessionRecord.updated_at < self._cutoff()))
+            db.add(ChatSessionRecord(id=session.id))
+            db.commit()
+        self._remember(session)
+        return session
+
+    def save(self, session: ChatSession):
+        if not session.id:
+            return
+        with Session(engine) as db:
+            record = db.get(ChatSessionRecord, session.id) or ChatSessionRecord(id=session.id)
+            record.messages = json.dumps([{"role": m.role, "content": m.content} for m in session.messages],
+                                         ensure_ascii=False)
+            record.active_product_name = session.active_product_name
+            record.offset = session.offset
+            record.version = (record.version or 0) + 1
+            record.updated_at = datetime.utcnow()
+            db.add(record)
+            db.commit()
+            session.version = record.version
+        self._remember(session)
+
+    def delete(self, session_id: str) -> bool:
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        with Session(engine) as db:
+            record = db.get(ChatSessionRecord, session_id)
+            if record is None:
+                return False
+            db.delete(record)
+            db.commit()
+            return True
+
+    def stats(self) -> dict:
+        with Session(engine) as db:
+            active = db.exec(select(func.count()).select_from(ChatSessionRecord)
+                             .where(ChatSessionRecord.updated_at >= self._cutoff())).one()
+        with self.lock:
+            cached = len(self.sessions)
+        return {"sessions": active, "cached": cached, "max_sessions": self.max_sessions, "ttl_s": self.ttl}
+
+
+chat_sessions = ChatSessionStore()
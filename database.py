@@ -1,23 +1,59 @@
-import os
-from sqlmodel import SQLModel, create_engine, Session
-from dotenv import load_dotenv
-
-load_dotenv()
-
-db_url = os.getenv("DATABASE_URL")
-
-if db_url and db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
-
-engine = create_engine(db_url, echo=True)
-
-def create_db_and_tables():
-    from models import Product, Review, Insight
-    SQLModel.metadata.create_all(engine)
-
-def get_session():
-    with Session(engine) as session:
-        yield session
-
-if __name__ == '__main__':
+import os
+import functools
+from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import inspect, text
+from dotenv import load_dotenv
+from metrics import instrument_engine
+
+load_dotenv()
+
+db_url = os.getenv("DATABASE_URL")
+
+if db_url and db_url.startswith("postgres://"):
+    db_url = db_url.replace("postgres://", "postgresql://", 1)
+
+engine = create_engine(db_url, echo=True)
+instrument_engine(engine)
+
+@functools.lru_cache(maxsize=None)
+def engine_with_timeout(seconds: float):
+    # Limit czasu zapytań jako opcja połączenia (osobna, mała pula) - bez dodatkowego SET przed każdym zapytaniem.
+    if engine.dialect.name != "postgresql":
+        return engine
+    timed = create_engine(db_url, echo=True, pool_size=2, max_overflow=8,
+                          connect_args={"options": f"-c statement_timeout={int(seconds * 1000)}"})
+    instrument_engine(timed)
+    return timed
+
+def add_missing_columns():
+    # create_all nie zmienia istniejących tabel - dokładamy nowe kolumny (nullable albo z server_default).
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or column.primary_key:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                print(f"🛠️ Baza: Dodano kolumnę {table.name}.{column.name}")
+
+def create_db_and_tables():
+    from models import Product, Review, Insight, AnalysisJob, SearchCacheEntry, ChatSessionRecord
+    from product_search import ensure_search_index
+    SQLModel.metadata.create_all(engine)
+    add_missing_columns()
+    ensure_search_index(engine)
+    from analysis_service import backfill_input_stats
+    backfill_input_stats()
+
+def get_session():
+    with Session(engine) as session:
+        yield session
+
+if __name__ == '__main__':
     create_db_and_tables()
\ No newline at end of file
@@ -0,0 +1,67 @@
+import os
+import json
+import argparse
+import socketserver
+import numpy as np
+from embeddings import (EMBEDDING_BACKEND, EMBEDDING_SOCKET, EmbeddingBatcher, create_backend, embedding_key,
+                        recv_frame, send_frame)
+
+DEFAULT_SOCKET = os.path.join(os.getenv("RAG_CACHE_DIR", ".rag_cache"), "embed.sock")
+
+
+class EmbeddingHandler(socketserver.BaseRequestHandler):
+    # Jedno połączenie na wątek workera; zapytania z wielu połączeń łączy wspólny batcher.
+    def handle(self):
+        while True:
+            try:
+                frame = recv_frame(self.request)
+            except (OSError, ConnectionError):
+                return
+            if frame is None:
+                return
+            try:
+                request = json.loads(frame)
+                if request.get("op") == "info":
+                    send_frame(self.request, json.dumps(self.server.info).encode("utf-8"))
+                    continue
+                vectors = np.ascontiguousarray(self.server.batcher.encode(request["texts"]), dtype="float32")
+            except Exception as e:
+                send_frame(self.request, json.dumps({"error": str(e)[:300]}).encode("utf-8"))
+                continue
+            send_frame(self.request, json.dumps({"shape": list(vectors.shape)}).encode("utf-8"))
+            send_frame(self.request, vectors.tobytes())
+
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, backend_name: str = EMBEDDING_BACKEND):
+        backend = create_backend(backend_name, socket_path="")
+        self.batcher = EmbeddingBatcher(backend)
+        self.info = {"backend": backend.name, "dimension": backend.dimension, "key": embedding_key(backend_name)}
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        super().__init__(path, EmbeddingHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wspólny proces embeddingów dla workerów API (gniazdo Unix).")
+    parser.add_argument("--socket", default=EMBEDDING_SOCKET or DEFAULT_SOCKET)
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND, choices=["torch", "onnx", "onnx-int8", "fake"])
+    args = parser.parse_args()
+
+    server = EmbeddingServer(args.socket, args.backend)
+    print(f"🧠 Sidecar embeddingów: {server.info['backend']} (wymiar {server.info['dimension']}) na {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import os
+import re
+import json
+import hashlib
+import time
+import queue
+import socket
+import struct
+import threading
+import concurrent.futures
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_REPO = os.getenv("EMBEDDING_REPO", f"sentence-transformers/{EMBEDDING_MODEL}")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # torch | onnx | onnx-int8 | fake
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(os.getenv("RAG_CACHE_DIR", ".rag_cache"), "onnx"))
+EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", "128"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = domyślne ustawienie ONNX Runtime
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "2"))
+# Ścieżka gniazda embed_sidecar.py - wtedy model jest w jednym procesie zamiast w każdym workerze uvicorna.
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET", "")
+EMBEDDING_SOCKET_TIMEOUT_S = float(os.getenv("EMBEDDING_SOCKET_TIMEOUT_S", "10"))
+EMBEDDING_FAKE_DIM = int(os.getenv("EMBEDDING_FAKE_DIM", "384"))
+
+
+def embedding_key(backend: str = EMBEDDING_BACKEND) -> str:
+    # Wersja kwantyzowana daje nieco inne wektory - nie mieszamy ich w cache z pełną precyzją.
+    if backend in ("onnx-int8", "fake"):
+        return f"{EMBEDDING_MODEL}:{'int8' if backend == 'onnx-int8' else 'fake'}"
+    return EMBEDDING_MODEL
+
+
+class EmbeddingBackend:
+    name = "base"
+    dimension = 0
+
+    def encode(self, texts: list) -> np.ndarray:
+        raise NotImplementedError
+
+
+class TorchBackend(EmbeddingBackend):
+    name = "torch"
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list) -> np.ndarray:
+        return np.asarray(self.model.encode(texts), dtype="float32")
+
+
+class OnnxBackend(EmbeddingBackend):
+    # Ten sam model wyeksportowany do ONNX (bez PyTorcha): tokenizer z `tokenizers` + mean pooling jak w SentenceTransformer.
+    name = "onnx"
+
+    def __init__(self, repo: str = EMBEDDING_REPO, quantize: bool = False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path, tokenizer_path = self._fetch(repo)
+        if quantize:
+            self.name = "onnx-int8"
+            model_path = self._quantize(model_path)
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=EMBEDDING_MAX_LENGTH)
+        pad_token = next((t for t in ("<pad>", "[PAD]") if self.tokenizer.token_to_id(t) is not None), None)
+        if pad_token:
+            self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+        else:
+            self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        if EMBEDDING_THREADS:
+            options.intra_op_num_threads = EMBEDDING_THREADS
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dimension = int(self.session.get_outputs()[0].shape[-1])
+
+    def _fetch(self, repo: str) -> tuple[str, str]:
+        local_model = os.path.join(EMBEDDING_ONNX_DIR, "model.onnx")
+        local_tokenizer = os.path.join(EMBEDDING_ONNX_DIR, "tokenizer.json")
+        if os.path.exists(local_model) and os.path.exists(local_tokenizer):
+            return local_model, local_tokenizer
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(repo, EMBEDDING_ONNX_FILE), hf_hub_download(repo, "tokenizer.json")
+
+    def _quantize(self, model_path: str) -> str:
+        quantized = os.path.join(EMBEDDING_ONNX_DIR, "model_int8.onnx")
+        if not os.path.exists(quantized):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            os.makedirs(EMBEDDING_ONNX_DIR, exist_ok=True)
+            tmp = quantized + ".tmp"
+            quantize_dynamic(model_path, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, quantized)
+            print(f"🗜️ Embeddingi: Zapisano model int8 ({quantized}).")
+        return quantized
+
+    def encode(self, texts: list) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dimension), dtype="float32")
+        batch = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in batch], dtype="int64")
+        attention_mask = np.array([e.attention_mask for e in batch], dtype="int64")
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        token_embeddings = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+        mask = attention_mask[..., None].astype("float32")
+        return ((token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)).astype("float32")
+
+
+class FakeBackend(EmbeddingBackend):
+    # Atrapa do testów offline (loadtest --spawn): haszowane słowa zamiast modelu, bez pobierania z HF.
+    name = "fake"
+
+    def __init__(self, dimension: int = EMBEDDING_FAKE_DIM):
+        self.dimension = dimension
+
+    def encode(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype="float32")
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                slot = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+                vectors[i, slot % self.dimension] += 1.0
+        return vectors
+
+
+def send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(struct.pack(">I", len(payload)) + payload)
+
+
+def recv_frame(sock: socket.socket) -> bytes | None:
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    payload = _recv_exact(sock, struct.unpack(">I", header)[0])
+    if payload is None:
+        raise ConnectionError("Połączenie przerwane w trakcie ramki")
+    return payload
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes | None:
+    parts, remaining = [], size
+    while remaining:
+        part = sock.recv(remaining)
+        if not part:
+            return None
+        parts.append(part)
+        remaining -= len(part)
+    return b"".join(parts)
+
+
+class SidecarBackend(EmbeddingBackend):
+    # Klient embed_sidecar.py: zapytanie to ramka JSON, odpowiedź - nagłówek JSON i surowe float32.
+    name = "sidecar"
+
+    def __init__(self, path: str = EMBEDDING_SOCKET, timeout_s: float = EMBEDDING_SOCKET_TIMEOUT_S):
+        self.path = path
+        self.timeout_s = timeout_s
+        self.local = threading.local()
+        info = self._call({"op": "info"})
+        if info["key"] != embedding_key():
+            raise RuntimeError(f"Sidecar koduje modelem {info['key']}, a worker oczekuje {embedding_key()}")
+        self.dimension = info["dimension"]
+        self.remote_backend = info["backend"]
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout_s)
+            sock.connect(self.path)
+            self.local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self.local, "sock", None)
+        self.local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _call(self, request: dict, payload: bool = False):
+        # Jedno ponowienie na nowym połączeniu - sidecar mógł zostać zrestartowany.
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_frame(sock, json.dumps(request, ensure_ascii=False).encode("utf-8"))
+                header = recv_frame(sock)
+                if header is None:
+                    raise ConnectionError("Sidecar zamknął połączenie")
+                header = json.loads(header)
+                if header.get("error"):
+                    raise RuntimeError(f"Sidecar: {header['error']}")
+                if not payload:
+                    return header
+                body = recv_frame(sock)
+                if body is None:
+                    raise ConnectionError("Sidecar zamknął połączenie")
+                return np.frombuffer(body, dtype="float32").reshape(header["shape"])
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt:
+                    raise
+
+    def encode(self, texts: list) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dimension), dtype="float32")
+        return self._call({"op": "encode", "texts": list(texts)}, payload=True)
+
+
+def create_backend(name: str = EMBEDDING_BACKEND, socket_path: str = EMBEDDING_SOCKET) -> EmbeddingBackend:
+    if socket_path:
+        return SidecarBackend(socket_path)
+    if name == "torch":
+        return TorchBackend()
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(quantize=name == "onnx-int8")
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"Nieznany backend embeddingów: {name}")
+
+
+class EmbeddingBatcher:
+    # Zapytania z równoległych żądań /chat trafiają do kolejki i są kodowane razem w jednym przebiegu modelu.
+    def __init__(self, backend: EmbeddingBackend, max_batch: int = EMBED_BATCH_MAX, max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000
+        self.requests = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+                self.thread.start()
+
+    def _loop(self):
+        while True:
+            pending = [self.requests.get()]
+            size = len(pending[0][0])
+            deadline = pending[0][2] + self.max_wait_s
+            while size < self.max_batch:
+                try:
+                    item = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            texts = [t for item in pending for t in item[0]]
+            try:
+                vectors = self.backend.encode(texts)
+            except Exception as e:
+                for _, future, _ in pending:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(pending)
+            offset = 0
+            for batch_texts, future, _ in pending:
+                future.set_result(vectors[offset:offset + len(batch_texts)])
+                offset += len(batch_texts)
+
+    def encode(self, texts: list) -> np.ndarray:
+        # Duże paczki (indeksowanie bazy wiedzy) idą bezpośrednio - batcher służy krótkim zapytaniom.
+        if self.max_batch <= 1 or len(texts) >= self.max_batch:
+            return self.backend.encode(texts)
+        self._ensure_worker()
+        future = concurrent.futures.Future()
+        self.requests.put((list(texts), future, time.monotonic()))
+        return future.result()
+
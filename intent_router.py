@@ -0,0 +1,206 @@
+import os
+import re
+import threading
+import numpy as np
+from dataclasses import dataclass, asdict
+from dotenv import load_dotenv
+from prompt_budget import split_product_card
+
+load_dotenv()
+
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "hybrid")  # off | rules | hybrid
+INTENT_MIN_SIMILARITY = float(os.getenv("INTENT_MIN_SIMILARITY", "0.75"))
+INTENT_MIN_MARGIN = float(os.getenv("INTENT_MIN_MARGIN", "0.08"))
+INTENT_MAX_NAME_CHARS = 80
+
+LOOKUP_RE = re.compile(
+    r"^\s*(?:pokaż|pokaz|znajdź|znajdz|wyszukaj|poszukaj|szukam|wyświetl|wyswietl)\s+"
+    r"(?:mi\s+)?(?:produkt(?:u)?\s+|kart[eęy]\s+(?:produktu\s+)?)?(?P<name>.+?)[\s?.!]*$",
+    re.IGNORECASE
+)
+INSTALLMENT_RE = re.compile(r"\brat(?:a|y|ę|e|ach|ami)?\b|\bratal\w*", re.IGNORECASE)
+MONTHS_RE = re.compile(r"(?:na\s+)?(\d{1,2})\s*(?:rat\w*|miesi\w*|mies\b|m-c\w*)", re.IGNORECASE)
+# Porównania, alternatywy i budżet ("tańsze od iPhone 15", "coś do 2000 zł") to nie wyszukanie jednego produktu.
+NOT_LOOKUP_RE = re.compile(
+    r"\b(?:alternatyw\w*|zamiennik\w*|tańsz\w*|tansz\w*|droższ\w*|drozsz\w*|podobn\w*|lepsz\w*|gorsz\w*|"
+    r"porówn\w*|porown\w*|zamiast|versus|vs|budżet\w*|budzet\w*|poniżej|ponizej|powyżej|powyzej|"
+    r"od\s+\d[\d\s]*(?:zł|zl|pln)?|do\s+\d[\d\s]*(?:zł|zl|pln|tys\w*|k)?)\b",
+    re.IGNORECASE
+)
+PRICE_RE = re.compile(r"(\d[\d\s]*(?:[.,]\d{1,2})?)\s*(?:zł|zl|pln)\b", re.IGNORECASE)
+
+# Słowa, które zostają po wycięciu nazwy produktu z pytania rozpoznanego przez embeddingi.
+FILLER_WORDS = {
+    "pokaż", "pokaz", "znajdź", "znajdz", "szukam", "wyszukaj", "poszukaj", "wyświetl", "wyswietl", "mi", "daj",
+    "chcę", "chce", "zobaczyć", "zobaczyc", "czy", "masz", "macie", "jest", "w", "bazie", "kartę", "karte",
+    "produkt", "produktu", "produkcie", "proszę", "prosze", "informacje", "o", "na", "temat", "dane", "jakiś",
+    "jakis",
+    # Same ogólne słowa ("pokaż opinie", "znajdź tańsze") to nie nazwa produktu - takie pytania zostają dla LLM.
+    "opinie", "zalety", "wady", "cena", "cenę", "cene", "tańsze", "tansze", "droższe", "drozsze", "podobne", "inne",
+    "coś", "cos", "więcej", "wiecej", "oferty", "linki", "zdjęcie", "zdjecie", "alternatywy", "go", "ją", "ja", "to",
+    "ten", "tego", "ta", "tę", "te", "tej",
+    # Odmienione formy - "pokaż zdjęcia", "szukam czegoś" też nie zawierają nazwy produktu.
+    "zdjęcia", "zdjecia", "zdjęć", "zdjec", "czegoś", "czegos", "czymś", "czyms", "jakiegoś", "jakiegos", "jakąś",
+    "jakas", "opinii", "opinię", "recenzje", "recenzji", "ceny", "ofert", "ofertę", "oferte", "linku",
+    "link", "parametry", "specyfikację", "specyfikacje", "szczegóły", "szczegoly", "wszystko", "wszystkie", "mnie",
+}
+
+LOOKUP_EXAMPLES = [
+    "Pokaż mi iPhone 15",
+    "Znajdź słuchawki Sony WH-1000XM5",
+    "Szukam laptopa Lenovo ThinkPad",
+    "Chcę zobaczyć Samsung Galaxy S24",
+    "Czy masz w bazie Xiaomi Redmi Note 13?",
+    "Daj kartę produktu Dyson V15",
+    "Informacje o produkcie MacBook Air M3",
+]
+OTHER_EXAMPLES = [
+    "Jaki ma ekran?",
+    "Czy jest dobry do gier?",
+    "W jakich kolorach jest dostępny?",
+    "Jak długo trzyma bateria?",
+    "Co mówi regulamin sklepu?",
+    "Jaki jest kod rabatowy?",
+    "Który z nich jest lepszy do pracy?",
+    "Dzień dobry, w czym możesz pomóc?",
+    "Dziękuję za pomoc",
+    "Czy warto go kupić?",
+]
+
+
+@dataclass
+class IntentMatch:
+    tool: str
+    args: dict
+    source: str  # rules | embedding
+    score: float = 1.0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def parse_amount(text: str) -> float | None:
+    try:
+        return float(re.sub(r"\s", "", text).replace(",", "."))
+    except ValueError:
+        return None
+
+
+def latest_card_price(messages: list, product_name: str | None) -> float | None:
+    # Cena aktualnego produktu z ostatniej karty w historii - "ile wyniesie rata na 12 miesięcy?" jej nie podaje.
+    for message in reversed(messages):
+        if message.role != "assistant":
+            continue
+        _, card = split_product_card(message.content)
+        if card and (not product_name or card.get("name") == product_name):
+            try:
+                return float(card.get("price"))
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def clean_product_name(text: str) -> str | None:
+    words = [w for w in re.findall(r"[\w'\-+.]+", text) if w.lower() not in FILLER_WORDS]
+    # "słuchawki Sony WH-1000XM5" -> "Sony WH-1000XM5": kategoria pisana małą literą przed nazwą marki.
+    while len(words) > 1 and words[0].isalpha() and words[0].islower() and words[1][:1].isupper():
+        words.pop(0)
+    name = " ".join(words).strip(" .'")
+    if len(name) < 2 or len(name) > INTENT_MAX_NAME_CHARS:
+        return None
+    # Nazwa produktu ma markę albo model (wielka litera, cyfra) - "szukam laptopa" zostaje dla LLM.
+    if not any(c.isupper() or c.isdigit() for c in name):
+        return None
+    return name
+
+
+class IntentRouter:
+    # Oczywiste wywołania narzędzi rozpoznajemy lokalnie (reguły, potem podobieństwo embeddingów do przykładów),
+    # więc nie płacimy za pierwsze zapytanie do LLM. Wszystko niejednoznaczne zostaje dla modelu.
+    def __init__(self, encoder=None, mode: str = INTENT_ROUTER, min_similarity: float = INTENT_MIN_SIMILARITY,
+                 min_margin: float = INTENT_MIN_MARGIN):
+        self.encoder = encoder
+        self.mode = mode
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.examples = None
+        self.lock = threading.Lock()
+
+    def route(self, text: str, messages: list, active_product: str | None) -> IntentMatch | None:
+        if self.mode == "off" or not text:
+            return None
+        match = self.match_installment(text, messages, active_product) or self.match_lookup_rule(text)
+        if match is None and self.mode == "hybrid":
+            match = self.match_lookup_embedding(text)
+        return match
+
+    def match_installment(self, text: str, messages: list, active_product: str | None) -> IntentMatch | None:
+        if not INSTALLMENT_RE.search(text):
+            return None
+        months = MONTHS_RE.search(text)
+        if not months:
+            return None
+        price = PRICE_RE.search(text)
+        price = parse_amount(price.group(1)) if price else latest_card_price(messages, active_product)
+        months = int(months.group(1))
+        if not price or price <= 0 or not 3 <= months <= 48:
+            return None
+        return IntentMatch("calculate_installment", {"price": price, "months": months}, "rules")
+
+    def match_lookup_rule(self, text: str) -> IntentMatch | None:
+        if NOT_LOOKUP_RE.search(text):
+            return None
+        match = LOOKUP_RE.match(text)
+        if not match:
+            return None
+        name = clean_product_name(match.group("name"))
+        return IntentMatch("get_product_details", {"product_name": name}, "rules") if name else None
+
+    def _example_vectors(self) -> tuple[np.ndarray, np.ndarray] | None:
+        if self.examples is None:
+            with self.lock:
+                if self.examples is None:
+                    lookup = self._encode(LOOKUP_EXAMPLES)
+                    other = self._encode(OTHER_EXAMPLES)
+                    if lookup is None or other is None:
+                        return None
+                    self.examples = (lookup, other)
+        return self.examples
+
+    def _encode(self, texts: list) -> np.ndarray | None:
+        if self.encoder is None:
+            return None
+        vectors = self.encoder(texts)
+        if vectors is None:
+            return None
+        vectors = np.asarray(vectors, dtype="float32")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def match_lookup_embedding(self, text: str) -> IntentMatch | None:
+        if NOT_LOOKUP_RE.search(text):
+            return None
+        # Przed rozgrzaniem modelu (encoder zwraca None) działają same reguły.
+        try:
+            examples = self._example_vectors()
+            query = self._encode([text]) if examples is not None else None
+        except Exception as e:
+            print(f"⚠️ Router intencji: Błąd embeddingu: {e}")
+            return None
+        if query is None:
+            return None
+        lookup, other = examples
+        lookup_score = float((lookup @ query[0]).max())
+        other_score = float((other @ query[0]).max())
+        if lookup_score < self.min_similarity or lookup_score - other_score < self.min_margin:
+            return None
+        name = clean_product_name(text)
+        if not name:
+            return None
+        return IntentMatch("get_product_details", {"product_name": name}, "embedding", round(lookup_score, 3))
+
+    @staticmethod
+    def intro(match: IntentMatch, tool_result: dict) -> str:
+        if match.tool == "calculate_installment":
+            return tool_result.get("details", "")
+        return f"Oto znaleziony produkt: {tool_result.get('name', match.args.get('product_name'))}."
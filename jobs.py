@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import fcntl
+import socket
+import hashlib
+import threading
+import concurrent.futures
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, update
+from sqlmodel import Session, select
+from database import engine
+from models import AnalysisJob, JobStatus
+from analysis_service import (ingest_product, run_ai_analysis, run_incremental_analysis, mark_analysis_failed,
+                              find_stale_insights, find_outdated_products, refresh_product_data)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_BACKOFF_S = float(os.getenv("JOB_BACKOFF_S", "2"))
+# Zadanie w stanie RUNNING bez odnowionej dzierżawy uznajemy za porzucone (np. worker padł) i może je przejąć inny proces.
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "60"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+INSIGHT_REFRESH_INTERVAL_S = float(os.getenv("INSIGHT_REFRESH_INTERVAL_S", "3600"))
+INSIGHT_REFRESH_BATCH = int(os.getenv("INSIGHT_REFRESH_BATCH", "100"))
+# Harmonogram działa w jednym procesie: decyduje blokada pliku (jak zapis indeksu RAG); na kolejnych hostach można go wyłączyć.
+INSIGHT_SCHEDULER_ENABLED = os.getenv("INSIGHT_SCHEDULER_ENABLED", "1") == "1"
+INSIGHT_SCHEDULER_LOCK = os.getenv("INSIGHT_SCHEDULER_LOCK",
+                                   os.path.join(os.getenv("RAG_CACHE_DIR", ".rag_cache"), "scheduler.lock"))
+INSIGHT_RESCRAPE_AFTER_S = float(os.getenv("INSIGHT_RESCRAPE_AFTER_S", "0"))  # np. 604800; 0 = bez ponownego pobierania (płatne SerpApi)
+
+
+def analysis_job_key(name: str) -> str:
+    return "product:" + " ".join(name.lower().split())
+
+
+def batch_job_key(names: list[str]) -> str:
+    return "batch:" + hashlib.sha256("\x00".join(names).encode("utf-8")).hexdigest()
+
+
+def run_batch_job(payload: dict, update) -> None:
+    # Import przez API idzie tą samą ścieżką co CLI: limit zapytań do SerpApi, równoległe scrapowanie, zapis paczkami.
+    from bulk_ingest import ingest_products, enqueue_analysis
+    stats = ingest_products(payload["products"])
+    stats["job_ids"] = enqueue_analysis(stats["products"]) if payload.get("analyze", True) else []
+    update(result=json.dumps(stats, ensure_ascii=False))
+
+
+def run_analysis_job(job: AnalysisJob, update) -> int | None:
+    payload = json.loads(job.payload)
+    if payload.get("mode") == "batch":
+        return run_batch_job(payload, update)
+    product_id = job.product_id or payload.get("product_id")
+    if not product_id:
+        product_id = ingest_product(payload["name"], payload["price"], payload.get("image_url"), payload["link"])
+        update(product_id=product_id)
+    if payload.get("mode") == "rescrape":
+        refresh_product_data(product_id)
+    if payload.get("mode") in ("refresh", "rescrape"):
+        run_incremental_analysis(product_id)
+    else:
+        run_ai_analysis(product_id)
+    return product_id
+
+
+class JobQueue:
+    def __init__(self, handler, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 backoff_s: float = JOB_BACKOFF_S, lease_s: float = JOB_LEASE_S):
+        self.handler = handler
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.lease_s = lease_s
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.in_flight: dict[str, int] = {}
+        self.running: set[int] = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat = None
+
+    def _claimable(self, now: datetime):
+        # Kolejka gotowa do ponowienia (lease_until to wtedy termin kolejnej próby) albo RUNNING z wygasłą dzierżawą.
+        return or_(
+            and_(AnalysisJob.status == JobStatus.QUEUED,
+                 or_(AnalysisJob.lease_until.is_(None), AnalysisJob.lease_until <= now, AnalysisJob.worker == WORKER_ID)),
+            and_(AnalysisJob.status == JobStatus.RUNNING,
+                 or_(AnalysisJob.lease_until.is_(None), AnalysisJob.lease_until < now)),
+        )
+
+    def _claim(self, job_id: int) -> AnalysisJob | None:
+        # Warunkowy UPDATE: zadanie przejmuje dokładnie jeden proces, nawet gdy wszystkie workery wznawiają kolejkę naraz.
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            claimed = conn.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id == job_id)
+                .where(self._claimable(now))
+                .values(status=JobStatus.RUNNING, attempts=AnalysisJob.attempts + 1, worker=WORKER_ID,
+                        lease_until=now + timedelta(seconds=self.lease_s), updated_at=now)
+            ).rowcount
+        if not claimed:
+            return None
+        with self.lock:
+            self.running.add(job_id)
+        return self.get(job_id)
+
+    def _renew_leases(self):
+        with self.lock:
+            running = list(self.running)
+        if not running:
+            return
+        with engine.begin() as conn:
+            conn.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id.in_(running))
+                .where(AnalysisJob.worker == WORKER_ID)
+                .where(AnalysisJob.status == JobStatus.RUNNING)
+                .values(lease_until=datetime.utcnow() + timedelta(seconds=self.lease_s))
+            )
+
+    def _heartbeat_loop(self):
+        # Odnawia dzierżawy własnych zadań i przejmuje zadania porzucone przez inne procesy.
+        while not self.stop_event.wait(self.lease_s / 3):
+            try:
+                self._renew_leases()
+                self.resume_pending()
+            except Exception as e:
+                print(f"⚠️ Kolejka zadań: {e}")
+
+    def _ensure_heartbeat(self):
+        with self.lock:
+            if self.heartbeat is None and self.lease_s > 0:
+                self.heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+                self.heartbeat.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _update(self, job_id: int, **fields) -> AnalysisJob:
+        with Session(engine) as session:
+            job = session.get(AnalysisJob, job_id)
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = datetime.utcnow()
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+            return job
+
+    def submit(self, dedup_key: str, payload: dict, product_id: int | None = None) -> tuple[int, bool]:
+        # Single-flight: ten sam produkt w trakcie analizy zwraca istniejące zadanie zamiast tworzyć nowe.
+        with self.lock:
+            if dedup_key in self.in_flight:
+                return self.in_flight[dedup_key], False
+            with Session(engine) as session:
+                active = session.exec(
+                    select(AnalysisJob.id)
+                    .where(AnalysisJob.dedup_key == dedup_key)
+                    .where(AnalysisJob.status.in_([JobStatus.QUEUED, JobStatus.RUNNING]))
+                ).first()
+                if active:
+                    return active, False
+                job = AnalysisJob(dedup_key=dedup_key, payload=json.dumps(payload, ensure_ascii=False),
+                                  product_id=product_id)
+                session.add(job)
+                session.commit()
+                session.refresh(job)
+                job_id = job.id
+            self.in_flight[dedup_key] = job_id
+        self._ensure_heartbeat()
+        self.pool.submit(self._run, job_id, dedup_key)
+        return job_id, True
+
+    def _run(self, job_id: int, dedup_key: str):
+        try:
+            while True:
+                job = self._claim(job_id)
+                if job is None:
+                    return
+                attempt = job.attempts
+                try:
+                    product_id = self.handler(job, lambda **f: self._update(job_id, **f))
+                    self._update(job_id, status=JobStatus.COMPLETED, product_id=product_id, error=None, lease_until=None)
+                    return
+                except Exception as e:
+                    print(f"⚠️ Zadanie {job_id} (próba {attempt}/{self.max_attempts}): {e}")
+                    if attempt >= self.max_attempts:
+                        self._update(job_id, status=JobStatus.ERROR, error=str(e)[:500], lease_until=None)
+                        self._on_give_up(job_id)
+                        return
+                    delay = self.backoff_s * 2 ** (attempt - 1)
+                    with self.lock:
+                        self.running.discard(job_id)
+                    self._update(job_id, status=JobStatus.QUEUED, error=str(e)[:500],
+                                 lease_until=datetime.utcnow() + timedelta(seconds=delay))
+                    time.sleep(delay)
+        finally:
+            with self.lock:
+                self.in_flight.pop(dedup_key, None)
+                self.running.discard(job_id)
+
+    def _on_give_up(self, job_id: int):
+        with Session(engine) as session:
+            job = session.get(AnalysisJob, job_id)
+            if job and job.product_id:
+                mark_analysis_failed(job.product_id)
+
+    def resume_pending(self):
+        # Tylko zadania bez żywego właściciela; samo przejęcie i tak rozstrzyga warunkowy UPDATE w _claim.
+        self._ensure_heartbeat()
+        with Session(engine) as session:
+            pending = session.exec(
+                select(AnalysisJob.id, AnalysisJob.dedup_key).where(self._claimable(datetime.utcnow()))
+            ).all()
+        resumed = 0
+        for job_id, dedup_key in pending:
+            with self.lock:
+                if dedup_key in self.in_flight:
+                    continue
+                self.in_flight[dedup_key] = job_id
+            self.pool.submit(self._run, job_id, dedup_key)
+            resumed += 1
+        if resumed:
+            print(f"🔁 Wznowiono {resumed} zadań analizy.")
+
+    def get(self, job_id: int) -> AnalysisJob | None:
+        with Session(engine) as session:
+            return session.get(AnalysisJob, job_id)
+
+
+job_queue = JobQueue(run_analysis_job)
+
+
+class InsightRefreshScheduler:
+    def __init__(self, queue: JobQueue, interval_s: float = INSIGHT_REFRESH_INTERVAL_S,
+                 batch: int = INSIGHT_REFRESH_BATCH, rescrape_after_s: float = INSIGHT_RESCRAPE_AFTER_S):
+        self.queue = queue
+        self.interval_s = interval_s
+        self.batch = batch
+        self.rescrape_after_s = rescrape_after_s
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock_file = None
+
+    def _acquire_lock(self) -> bool:
+        # Zwalnia ją system przy końcu procesu - po awarii harmonogram przejmuje następny worker.
+        if self.lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(INSIGHT_SCHEDULER_LOCK) or ".", exist_ok=True)
+        lock_file = open(INSIGHT_SCHEDULER_LOCK, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def rescrape_outdated(self) -> int:
+        # Jedna paczka na przebieg - ponowne pobieranie kosztuje zapytania do SerpApi.
+        if self.rescrape_after_s <= 0:
+            return 0
+        outdated = find_outdated_products(datetime.utcnow() - timedelta(seconds=self.rescrape_after_s), self.batch)
+        queued = 0
+        for product_id, name in outdated:
+            _, created = self.queue.submit(analysis_job_key(name), {"product_id": product_id, "mode": "rescrape"},
+                                           product_id=product_id)
+            queued += created
+        return queued
+
+    def run_once(self) -> int:
+        queued, cursor = self.rescrape_outdated(), 0
+        while True:
+            stale, cursor = find_stale_insights(after_id=cursor, limit=self.batch)
+            for product_id, name in stale:
+                _, created = self.queue.submit(analysis_job_key(name), {"product_id": product_id, "mode": "refresh"},
+                                               product_id=product_id)
+                queued += created
+            if not cursor:
+                break
+        if queued:
+            print(f"♻️ Zaplanowano odświeżenie {queued} analiz.")
+        return queued
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval_s):
+            if not self._acquire_lock():
+                continue
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️ Odświeżanie analiz: {e}")
+
+    def start(self):
+        if not INSIGHT_SCHEDULER_ENABLED or self.interval_s <= 0 or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._loop, name="insight-refresh", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+insight_scheduler = InsightRefreshScheduler(job_queue)
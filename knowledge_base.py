@@ -0,0 +1,211 @@
+import os
+import glob
+import time
+import fcntl
+import threading
+import requests
+from dotenv import load_dotenv
+from rag_engine import RagEngine, rag, chunk_hash, split_chunks, DEFAULT_DOC_ID, RAG_SHARED
+from vector_index import vector_ids
+
+load_dotenv()
+
+# Np. "gdoc:<id>,file:docs/regulamin.md,dir:knowledge" - domyślnie sam GOOGLE_DOC_ID.
+KB_SOURCES = os.getenv("KB_SOURCES", "")
+KB_REFRESH_INTERVAL_S = float(os.getenv("KB_REFRESH_INTERVAL_S", "900"))
+KB_FETCH_TIMEOUT_S = float(os.getenv("KB_FETCH_TIMEOUT_S", "30"))
+KB_SHARED_POLL_S = float(os.getenv("KB_SHARED_POLL_S", "5"))
+KB_FILE_EXTENSIONS = (".txt", ".md")
+
+
+class KnowledgeSource:
+    kind = "base"
+
+    def __init__(self, ref: str):
+        self.ref = ref
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}:{self.ref}"
+
+    def fetch(self) -> str:
+        raise NotImplementedError
+
+
+class GoogleDocSource(KnowledgeSource):
+    kind = "gdoc"
+
+    def fetch(self) -> str:
+        url = f"https://docs.google.com/document/d/{self.ref}/export?format=txt"
+        response = requests.get(url, timeout=KB_FETCH_TIMEOUT_S)
+        response.raise_for_status()
+        return response.text
+
+
+class FileSource(KnowledgeSource):
+    kind = "file"
+
+    def fetch(self) -> str:
+        with open(self.ref, encoding="utf-8") as f:
+            return f.read()
+
+
+class DirectorySource(KnowledgeSource):
+    kind = "dir"
+
+    def fetch(self) -> str:
+        if not os.path.isdir(self.ref):
+            raise FileNotFoundError(f"Brak katalogu {self.ref}")
+        paths = sorted(p for p in glob.glob(os.path.join(self.ref, "**", "*"), recursive=True)
+                       if p.lower().endswith(KB_FILE_EXTENSIONS))
+        texts = []
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                texts.append(f.read())
+        return "\n\n".join(texts)
+
+
+SOURCE_TYPES = {cls.kind: cls for cls in (GoogleDocSource, FileSource, DirectorySource)}
+
+
+def parse_sources(spec: str = KB_SOURCES, default_doc_id: str | None = DEFAULT_DOC_ID) -> list[KnowledgeSource]:
+    sources = []
+    for item in (s.strip() for s in spec.split(",")):
+        if not item:
+            continue
+        kind, _, ref = item.partition(":")
+        if kind not in SOURCE_TYPES or not ref:
+            print(f"⚠️ Baza wiedzy: Pomijam nieznane źródło '{item}'")
+            continue
+        sources.append(SOURCE_TYPES[kind](ref))
+    if not sources and default_doc_id:
+        sources.append(GoogleDocSource(default_doc_id))
+    return sources
+
+
+class KnowledgeBase:
+    def __init__(self, engine: RagEngine, sources: list[KnowledgeSource], interval_s: float = KB_REFRESH_INTERVAL_S,
+                 shared: bool = RAG_SHARED, poll_s: float = KB_SHARED_POLL_S):
+        self.engine = engine
+        self.sources = sources
+        self.interval_s = interval_s
+        self.shared = shared
+        self.poll_s = poll_s
+        self.writer_lock = None
+        self.source_chunks: dict[str, list[str]] = {}
+        self.status: dict[str, dict] = {}
+        self.last_refresh = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def restore(self) -> bool:
+        meta = self.engine.restore()
+        if meta is None:
+            return False
+        texts = self.engine.snapshot.texts
+        for key, hashes in meta.get("sources", {}).items():
+            self.source_chunks[key] = [texts[i] for i in vector_ids(hashes).tolist() if i in texts]
+        return True
+
+    @property
+    def role(self) -> str:
+        return "writer" if not self.shared or self.writer_lock is not None else "reader"
+
+    def _acquire_writer(self) -> bool:
+        # Blokada pliku w katalogu cache wybiera jeden proces, który pobiera źródła i zapisuje indeks.
+        # Zwalnia ją system przy końcu procesu, więc po awarii zapisującego rolę przejmuje następny worker.
+        if self.writer_lock is not None:
+            return True
+        os.makedirs(self.engine.cache_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.engine.cache_dir, "writer.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.writer_lock = lock_file
+        return True
+
+    def refresh(self) -> dict:
+        if self.shared and not self._acquire_writer():
+            self.engine.reload_if_changed()
+            return {"chunks": len(self.engine.snapshot.hashes), "added": 0, "removed": 0, "rebuilt": False,
+                    "role": self.role}
+        # Źródło, którego nie udało się pobrać, zostaje z poprzednimi fragmentami zamiast znikać z indeksu.
+        with self.lock:
+            for source in self.sources:
+                try:
+                    chunks = split_chunks(source.fetch())
+                    self.source_chunks[source.key] = chunks
+                    self.status[source.key] = {"ok": True, "chunks": len(chunks), "error": None}
+                except Exception as e:
+                    print(f"⚠️ Baza wiedzy: Nie udało się pobrać {source.key}: {e}")
+                    self.status[source.key] = {"ok": False, "chunks": len(self.source_chunks.get(source.key, [])),
+                                               "error": str(e)[:300]}
+            keys = [s.key for s in self.sources]
+            chunks = [c for key in keys for c in self.source_chunks.get(key, [])]
+            meta = {"sources": {key: [chunk_hash(c) for c in self.source_chunks.get(key, [])] for key in keys}}
+            stats = self.engine.load_chunks(chunks, meta=meta)
+            self.last_refresh = time.time()
+        if stats["added"] or stats["removed"]:
+            print(f"📚 Baza wiedzy: +{stats['added']} -{stats['removed']} fragmentów ({stats['chunks']} łącznie).")
+        return stats
+
+    def snapshot(self) -> dict:
+        return {
+            "sources": {s.key: self.status.get(s.key) for s in self.sources},
+            "chunks": len(self.engine.snapshot.hashes),
+            "index": self.engine.snapshot.config.kind,
+            "last_refresh": self.last_refresh,
+            "role": self.role,
+        }
+
+    def _loop(self, immediate: bool):
+        if immediate:
+            self._safe_refresh()
+        while not self.stop_event.wait(self.interval_s):
+            self._safe_refresh()
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"⚠️ Odświeżanie bazy wiedzy: {e}")
+
+    def _follow(self):
+        while not self.stop_event.wait(self.poll_s):
+            if self._acquire_writer():
+                print("✍️ Baza wiedzy: Przejmuję zapis wspólnego indeksu.")
+                self.restore()
+                self._loop(immediate=True)
+                return
+            try:
+                self.engine.reload_if_changed()
+            except Exception as e:
+                print(f"⚠️ Wczytywanie wspólnego indeksu: {e}")
+
+    def start(self):
+        if self.shared and not self._acquire_writer():
+            self.engine.restore(mmap=True)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._follow, name="knowledge-follow", daemon=True)
+                self.thread.start()
+            return
+        # Indeks z dysku jest dostępny od razu, a źródła odświeżamy w tle; bez cache pierwsze ładowanie jest synchroniczne.
+        restored = self.restore()
+        if not restored:
+            self._safe_refresh()
+        if self.thread is not None or (self.interval_s <= 0 and not restored):
+            return
+        if self.interval_s <= 0:
+            self.thread = threading.Thread(target=self._safe_refresh, name="knowledge-refresh", daemon=True)
+        else:
+            self.thread = threading.Thread(target=self._loop, args=(restored,), name="knowledge-refresh", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+knowledge_base = KnowledgeBase(rag, parse_sources())
@@ -0,0 +1,89 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STARTUP_RETRY_S = float(os.getenv("STARTUP_RETRY_S", "5"))
+STARTUP_MAX_RETRY_S = float(os.getenv("STARTUP_MAX_RETRY_S", "60"))
+
+
+class StartupStep:
+    def __init__(self, name: str, func, retry: bool = False):
+        self.name = name
+        self.func = func
+        self.retry = retry
+        self.status = "pending"  # pending | running | ok | failed
+        self.error = None
+        self.attempts = 0
+        self.duration_s = None
+
+    def snapshot(self) -> dict:
+        return {"status": self.status, "error": self.error, "attempts": self.attempts, "duration_s": self.duration_s}
+
+
+class Startup:
+    # Rozruch w tle: serwer przyjmuje połączenia od razu, a kolejne grupy kroków (baza, RAG) ruszają równolegle.
+    # Kroki w jednej grupie wykonują się po kolei - np. wznowienie zadań dopiero po utworzeniu tabel.
+    def __init__(self, retry_s: float = STARTUP_RETRY_S, max_retry_s: float = STARTUP_MAX_RETRY_S):
+        self.retry_s = retry_s
+        self.max_retry_s = max_retry_s
+        self.groups: list[list[StartupStep]] = []
+        self.threads = []
+        self.stop_event = threading.Event()
+        self.started_at = None
+
+    def group(self, *steps: StartupStep):
+        self.groups.append(list(steps))
+
+    @property
+    def steps(self) -> list[StartupStep]:
+        return [step for group in self.groups for step in group]
+
+    def _run_step(self, step: StartupStep) -> bool:
+        delay = self.retry_s
+        while not self.stop_event.is_set():
+            step.status = "running"
+            step.attempts += 1
+            start = time.perf_counter()
+            try:
+                step.func()
+                step.status, step.error = "ok", None
+                step.duration_s = round(time.perf_counter() - start, 3)
+                print(f"✅ Start: {step.name} gotowe w {step.duration_s}s.")
+                return True
+            except Exception as e:
+                step.status, step.error = "failed", str(e)[:300]
+                print(f"⚠️ Start: {step.name} nie powiódł się: {e}")
+                if not step.retry:
+                    return False
+            self.stop_event.wait(delay)
+            delay = min(delay * 2, self.max_retry_s)
+        return False
+
+    def _run_group(self, steps: list[StartupStep]):
+        for step in steps:
+            if not self._run_step(step):
+                return
+
+    def start(self):
+        self.started_at = time.time()
+        for i, steps in enumerate(self.groups):
+            thread = threading.Thread(target=self._run_group, args=(steps,), name=f"startup-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def ready(self) -> bool:
+        return all(step.status == "ok" for step in self.steps)
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "uptime_s": round(time.time() - self.started_at, 1) if self.started_at else None,
+            "steps": {step.name: step.snapshot() for step in self.steps},
+        }
@@ -0,0 +1,237 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from metrics import observe
+
+
+class ProviderStats:
+    def __init__(self, window: int = 50):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, latency: float | None, ok: bool):
+        if latency is not None and ok:
+            self.latencies.append(latency)
+        self.outcomes.append(ok)
+
+    def percentile(self, p: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 3, cooldown_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half_open"
+        return "open"
+
+    def _probing(self) -> bool:
+        # Próba bez wyniku (np. anulowane zapytanie) wygasa po cooldown_s, żeby nie zablokować dostawcy na zawsze.
+        return self.probe_started is not None and time.monotonic() - self.probe_started < self.cooldown_s
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing())
+
+    def allow(self) -> bool:
+        # W stanie half_open przepuszczamy jedno zapytanie próbne, a nie wszystkie równoległe.
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self._probing():
+            return False
+        self.probe_started = time.monotonic()
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self):
+        self.probe_started = None
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self):
+        self.opened_at = time.monotonic()
+
+
+class ProviderRouter:
+    def __init__(self, providers: list, timeout: float, max_concurrency: int, hedge_after: float = 0.0,
+                 window: int = 50, failure_threshold: int = 3, cooldown_s: float = 30.0,
+                 max_error_rate: float = 0.5, min_samples: int = 10):
+        self.providers = providers
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.stats = {p.name: ProviderStats(window) for p in providers}
+        self.breakers = {p.name: CircuitBreaker(failure_threshold, cooldown_s) for p in providers}
+        self.lock = threading.Lock()
+
+    def record(self, llm, latency: float | None, ok: bool):
+        observe("llm", llm.name, latency, ok)
+        with self.lock:
+            stats = self.stats[llm.name]
+            breaker = self.breakers[llm.name]
+            stats.record(latency, ok)
+            if ok:
+                breaker.record_success()
+                return
+            breaker.record_failure()
+            if len(stats.outcomes) >= self.min_samples and stats.error_rate > self.max_error_rate:
+                breaker.trip()
+
+    def acquire(self, llm) -> bool:
+        # Zgoda bezpiecznika w chwili wysłania zapytania (w half_open tylko jedna próba naraz).
+        with self.lock:
+            return self.breakers[llm.name].allow()
+
+    def candidates(self, provider: str = "auto") -> list:
+        pool = self.providers
+        if provider and provider != "auto":
+            chosen = [p for p in self.providers if p.name == provider]
+            if chosen:
+                pool = chosen
+            else:
+                print(f"⚠️ AI: Nieznany dostawca '{provider}', używam trybu auto.")
+        with self.lock:
+            healthy = [p for p in pool if self.breakers[p.name].available()]
+            if len(healthy) > 1 and all(len(self.stats[p.name].latencies) >= self.min_samples for p in healthy):
+                healthy.sort(key=lambda p: self.stats[p.name].percentile(50))
+        skipped = [p.name for p in pool if p not in healthy]
+        if skipped:
+            print(f"🔌 AI: Pomijam dostawców z otwartym bezpiecznikiem: {', '.join(skipped)}")
+        return healthy
+
+    def generate(self, prompt: str, provider: str = "auto") -> str | None:
+        for llm in self.candidates(provider):
+            if not self.acquire(llm):
+                continue
+            print(llm.label)
+            start = time.perf_counter()
+            try:
+                text = llm.generate(prompt)
+            except Exception as e:
+                self.record(llm, None, False)
+                print(f"⚠️ Błąd {llm.name}: {e}")
+                continue
+            self.record(llm, time.perf_counter() - start, True)
+            return text
+        return None
+
+    async def _attempt(self, llm, prompt: str) -> str | None:
+        if not self.acquire(llm):
+            return None
+        print(llm.label)
+        start = time.perf_counter()
+        try:
+            async with self.slots:
+                text = await asyncio.wait_for(llm.agenerate(prompt), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.record(llm, None, False)
+            print(f"⚠️ Błąd {llm.name}: przekroczono {self.timeout}s")
+            return None
+        except Exception as e:
+            self.record(llm, None, False)
+            print(f"⚠️ Błąd {llm.name}: {e}")
+            return None
+        self.record(llm, time.perf_counter() - start, True)
+        return text
+
+    async def agenerate(self, prompt: str, provider: str = "auto") -> str | None:
+        order = self.candidates(provider)
+        if self.hedge_after > 0 and len(order) > 1:
+            return await self._hedged(prompt, order)
+        for llm in order:
+            text = await self._attempt(llm, prompt)
+            if text is not None:
+                return text
+        return None
+
+    async def _hedged(self, prompt: str, order: list) -> str | None:
+        # Zapasowy dostawca startuje, gdy główny nie odpowie w hedge_after sekund (albo od razu po jego błędzie).
+        remaining = list(order[1:])
+        tasks = {asyncio.create_task(self._attempt(order[0], prompt))}
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=self.hedge_after if remaining else None,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result() is not None:
+                        return task.result()
+                if remaining and (not done or not tasks):
+                    llm = remaining.pop(0)
+                    print(f"🏁 AI: Hedging - uruchamiam {llm.name}")
+                    tasks.add(asyncio.create_task(self._attempt(llm, prompt)))
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def astream(self, prompt: str, provider: str = "auto"):
+        # Przełączamy się na kolejnego dostawcę tylko, jeśli poprzedni nie zdążył wysłać żadnego tokenu.
+        for llm in self.candidates(provider):
+            if not self.acquire(llm):
+                continue
+            started = False
+            print(llm.label)
+            start = time.perf_counter()
+            try:
+                async with self.slots:
+                    stream = llm.astream(prompt).__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                        except StopAsyncIteration:
+                            break
+                        if not started:
+                            observe("llm_first_token", llm.name, time.perf_counter() - start)
+                        started = True
+                        yield chunk
+                # Pełny czas strumienia - tak jak w generate, więc kolejność dostawców uwzględnia też streaming.
+                self.record(llm, time.perf_counter() - start, True)
+                return
+            except asyncio.TimeoutError:
+                self.record(llm, None, False)
+                print(f"⚠️ Błąd {llm.name}: brak tokenów przez {self.timeout}s")
+            except Exception as e:
+                self.record(llm, None, False)
+                print(f"⚠️ Błąd {llm.name}: {e}")
+            if started:
+                return
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                p.name: {
+                    "state": self.breakers[p.name].state,
+                    "p50_s": self.stats[p.name].percentile(50),
+                    "p95_s": self.stats[p.name].percentile(95),
+                    "error_rate": round(self.stats[p.name].error_rate, 3),
+                    "samples": len(self.stats[p.name].outcomes),
+                }
+                for p in self.providers
+            }
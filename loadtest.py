@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+import httpx
+
+CHAT_MESSAGES = [
+    "Jakie są zalety tego produktu?",
+    "Czy warto go kupić?",
+    "Pokaż Słuchawki testowe Pro",
+    "Jak działa procedura zwrotu?",
+    "Oblicz ratę dla ceny 3000 na 10 miesięcy",
+]
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class ScenarioResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.first_token = []
+        self.errors = 0
+        self.statuses = {}
+        self.elapsed = 0.0
+
+    def record(self, latency: float, status: int | str):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 200:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+
+    def summary(self) -> dict:
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        total = len(self.latencies) + self.errors
+        return {
+            "scenario": self.name,
+            "requests": total,
+            "errors": self.errors,
+            "throughput_rps": round(total / self.elapsed, 2) if self.elapsed else None,
+            "p50_ms": ms(percentile(self.latencies, 50)),
+            "p95_ms": ms(percentile(self.latencies, 95)),
+            "p99_ms": ms(percentile(self.latencies, 99)),
+            "max_ms": ms(max(self.latencies) if self.latencies else None),
+            "ttft_p50_ms": ms(percentile(self.first_token, 50)),
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+        }
+
+
+async def call_search(client: httpx.AsyncClient, i: int, args, result: ScenarioResult):
+    payload = {"query": f"{args.query} {i % args.distinct}"}
+    start = time.perf_counter()
+    resp = await client.post("/search", json=payload)
+    result.record(time.perf_counter() - start, resp.status_code)
+
+
+async def call_analyze(client: httpx.AsyncClient, i: int, args, result: ScenarioResult):
+    payload = {"name": f"{args.query} {i % args.distinct}", "price": 100.0 + i % 50, "image_url": "",
+               "link": "http://example.com"}
+    start = time.perf_counter()
+    resp = await client.post("/analyze", json=payload)
+    result.record(time.perf_counter() - start, resp.status_code)
+
+
+async def call_chat(client: httpx.AsyncClient, i: int, args, result: ScenarioResult):
+    payload = {"message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)], "provider": "auto",
+               "active_product_name": f"{args.query} Pro"}
+    start = time.perf_counter()
+    resp = await client.post("/chat", json=payload)
+    result.record(time.perf_counter() - start, resp.status_code)
+
+
+async def call_chat_stream(client: httpx.AsyncClient, i: int, args, result: ScenarioResult):
+    payload = {"message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)], "provider": "auto",
+               "active_product_name": f"{args.query} Pro"}
+    start = time.perf_counter()
+    first = None
+    async with client.stream("POST", "/chat/stream", json=payload) as resp:
+        async for line in resp.aiter_lines():
+            if first is None and line.startswith("event: token"):
+                first = time.perf_counter() - start
+    if first is not None:
+        result.first_token.append(first)
+    result.record(time.perf_counter() - start, resp.status_code)
+
+
+SCENARIOS = {
+    "search": call_search,
+    "analyze": call_analyze,
+    "chat": call_chat,
+    "chat_stream": call_chat_stream,
+}
+
+
+async def run_scenario(name: str, args) -> ScenarioResult:
+    result = ScenarioResult(name)
+    counter = iter(range(args.requests))
+    call = SCENARIOS[name]
+
+    async def worker(client: httpx.AsyncClient):
+        for i in counter:
+            try:
+                await call(client, i, args, result)
+            except Exception as e:
+                result.record(0.0, type(e).__name__)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        result.elapsed = time.perf_counter() - start
+    return result
+
+
+def spawn_server(args) -> subprocess.Popen:
+    # Serwer z atrapami LLM i SerpApi - test nie wychodzi do sieci i nie zużywa limitów API.
+    env = dict(os.environ)
+    env.setdefault("LLM_FAKE", "1")
+    env.setdefault("SERP_FAKE", "1")
+    env.setdefault("DATABASE_URL", "sqlite:///loadtest.db")
+    if env["LLM_FAKE"] == "1":
+        # /health/ready czeka na model embeddingów i bazę wiedzy - offline bez pobierania z HF i Google Docs.
+        env.setdefault("EMBEDDING_BACKEND", "fake")
+        env.setdefault("GOOGLE_DOC_ID", "")
+        env.setdefault("KB_SOURCES", "")
+    port = httpx.URL(args.url).port or 8000
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL if args.quiet else None
+    )
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Serwer zakończył się z kodem {proc.returncode}")
+        try:
+            if httpx.get(f"{args.url}/health/ready", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("Serwer nie wystartował na czas.")
+
+
+def print_report(summaries: list[dict]):
+    cols = ["scenario", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "ttft_p50_ms"]
+    print(" | ".join(f"{c:>14}" for c in cols))
+    for s in summaries:
+        print(" | ".join(f"{str(s[c] if s[c] is not None else '-'):>14}" for c in cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test obciążeniowy /search, /analyze i /chat.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenarios", default="search,analyze,chat", help=f"Lista z: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100, help="Liczba zapytań na scenariusz")
+    parser.add_argument("--distinct", type=int, default=10, help="Liczba różnych zapytań/produktów")
+    parser.add_argument("--query", default="Słuchawki testowe")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--spawn", action="store_true", help="Uruchom serwer z LLM_FAKE=1 i SERP_FAKE=1")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--quiet", action="store_true", help="Ukryj logi uruchomionego serwera")
+    parser.add_argument("--out", help="Zapisz wyniki do pliku JSON")
+    parser.add_argument("--max-p95-ms", type=float, help="Kod wyjścia 1, gdy p95 któregoś scenariusza go przekroczy")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"Nieznane scenariusze: {', '.join(unknown)}")
+
+    proc = spawn_server(args) if args.spawn else None
+    try:
+        summaries = []
+        for name in names:
+            print(f"🏋️ {name}: {args.requests} zapytań, współbieżność {args.concurrency}...")
+            summaries.append(asyncio.run(run_scenario(name, args)).summary())
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    print_report(summaries)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": summaries}, f, ensure_ascii=False, indent=2)
+    if args.max_p95_ms is not None:
+        slow = [s["scenario"] for s in summaries if s["p95_ms"] is None or s["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"❌ p95 powyżej {args.max_p95_ms} ms: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,301 +1,582 @@
-import json
-import re
-from fastapi import FastAPI, Depends, BackgroundTasks, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import Session, select
-from pydantic import BaseModel
-from database import get_session, engine, create_db_and_tables
-from models import Product, Review, Offer, Insight, AnalysisStatus
-from scraper import search_products_shallow, scrape_product_deep
-from ai_service import analyze_reviews_with_gemini, generate_ai_response
-from rag_engine import rag
-from tools import TOOLS_MAP, TOOLS_DESC
-import uvicorn
-from security import guard
-import logging
-
-create_db_and_tables()
-
-app = FastAPI()
-
-origins = [
-    "http://localhost:8051",
-    "http://127.0.0.1:8051",
-    "*"  
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-tool_logger = logging.getLogger("tool_logger")
-tool_logger.setLevel(logging.INFO)
-tool_logger.propagate = False
-
-file_handler = logging.FileHandler("tools_activity.log", mode="a", encoding="utf-8")
-formatter = logging.Formatter('%(asctime)s | %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-file_handler.setFormatter(formatter)
-tool_logger.addHandler(file_handler)
-
-def log_tool_activity(tool_name, status, details = "-"):
-    tool_logger.info(f"{tool_name} | {status} | {details}")
-
-class SearchQuery(BaseModel):
-    query: str
-    
-class AnalyzeRequest(BaseModel):
-    name: str
-    price: float
-    image_url: str
-    link: str
-
-class Message(BaseModel):
-    role: str  
-    content: str
-
-class ChatRequest(BaseModel):
-    messages: list[Message]  
-    provider: str = "auto"
-    active_product_name: str | None = None
-
-def process_ai_analysis(product_id: int):
-    with Session(engine) as session:
-        reviews = session.exec(select(Review).where(Review.product_id == product_id)).all()
-        offers = session.exec(select(Offer).where(Offer.product_id == product_id)).all()
-        if not reviews and not offers:
-            return
-
-        text_corpus = "RAPORT CENOWY:\n"
-        for o in offers:
-            text_corpus += f"- Sklep: {o.store_name}, Cena: {o.price} zł\n"
-        text_corpus += "\nOPINIE UŻYTKOWNIKÓW:\n"
-        for r in reviews:
-            text_corpus += f"- (Ocena: {r.rating}/5) {r.content}\n"
-        try:
-            result = analyze_reviews_with_gemini(text_corpus)
-            insight = session.exec(select(Insight).where(Insight.product_id == product_id)).first()
-            if insight:
-                insight.summary = result.get("summary", "Brak podsumowania")
-                insight.pros = result.get("pros", "Brak")
-                insight.cons = result.get("cons", "Brak")
-                insight.status = AnalysisStatus.COMPLETED
-                session.add(insight)
-                session.commit()
-
-        except Exception as e:
-            print(f"{e}")
-            insight = session.exec(select(Insight).where(Insight.product_id == product_id)).first()
-            if insight:
-                insight.status = AnalysisStatus.ERROR
-                session.add(insight)
-                session.commit()
-
-@app.post("/search")
-def search_endpoint(req: SearchQuery):
-    results = search_products_shallow(req.query)
-    return {"results": results}
-
-
-@app.post("/analyze")
-def analyze_endpoint(req: AnalyzeRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_session)):
-    existing = db.exec(select(Product).where(Product.name == req.name)).first()
-    if existing:
-        insight = db.exec(select(Insight).where(Insight.product_id == existing.id)).first()
-        if not insight or insight.status == AnalysisStatus.NONE:
-            background_tasks.add_task(process_ai_analysis, existing.id)
-        return {"message": "Produkt pobrany z cache", "id": existing.id}
-    data = scrape_product_deep(req.name, req.price, req.link)
-    try:
-        price_val = float(data["price"])
-    except:
-        price_val = 0.0
-    final_image = data.get("image_url") if data.get("image_url") else req.image_url
-    new_product = Product(
-        name=data["name"],
-        price=price_val,
-        image_url=final_image
-    )
-    db.add(new_product)
-    db.commit()
-    db.refresh(new_product)
-
-    for off in data.get("offers", []):
-        db.add(Offer(
-            product_id=new_product.id,
-            store_name=off["store"],
-            price=off["price"],
-            link=off["link"]
-        ))
-
-    for rev in data.get("reviews", []):
-        db.add(Review(
-            product_id=new_product.id,
-            content=rev["content"],
-            rating=rev["rating"],
-            source=rev.get("source", "unknown")
-        ))
-
-    insight = Insight(product_id=new_product.id, status=AnalysisStatus.PROCESSING)
-    db.add(insight)
-    db.commit()
-    background_tasks.add_task(process_ai_analysis, new_product.id)
-    return {"message": "Rozpoczęto analizę i zapisano produkt", "id": new_product.id}
-
-
-def security_guardrail(text: str) -> bool:
-    forbidden = ["ignore previous", "zapomnij instrukcje", "system prompt", "reveal"]
-    text_lower = text.lower()
-    if any(f in text_lower for f in forbidden):
-        return False
-    return True
-
-MAX_TOOL_OUTPUT_CHARS = 8000
-
-def truncate_tool_output(output: str, max_len: int = MAX_TOOL_OUTPUT_CHARS) -> str:
-    if len(output) > max_len:
-        return output[:max_len] + f"\n... [Przycięto {len(output)-max_len} znaków]"
-    return output
-@app.post("/chat")
-async def chat_endpoint(req: ChatRequest):
-
-    last_user_msg = req.messages[-1].content if req.messages else ""
-    provider = req.provider
-    rag_context = rag.search(last_user_msg, k=2)
-
-    if guard.check_path_traversal(last_user_msg):
-        raise HTTPException(status_code=400, detail="Wykryto niedozwolone znaki w zapytaniu.")
-
-    if not security_guardrail(last_user_msg):
-        raise HTTPException(status_code=400, detail="Zapytanie zablokowane.")
-    context_faq = rag.search(last_user_msg)
-    history_str = ""
-    for msg in req.messages:
-        prefix = "Użytkownik" if msg.role == "user" else "Asystent"
-        history_str += f"{prefix}: {msg.content}\n"
-    system_prompt = f"""
-        Jesteś Inteligentnym Asystentem Zakupowym. Twoim celem jest pomóc użytkownikowi w zakupach, łącząc twarde dane z bazy z twoją wiedzą ogólną.
-
-        ---------------------------------------------------
-        AKTUALNY KONTEKST:
-        - Użytkownik przegląda teraz produkt: "{req.active_product_name if req.active_product_name else 'Brak'}"
-        - Dodatkowa wiedza (RAG/Sekrety): {rag_context}
-        ---------------------------------------------------
-        ZASADA CARDINALNA (NAJWAŻNIEJSZA):
-        Twoja odpowiedź trafia BEZPOŚREDNIO do klienta na czacie.
-        ❌ NIE WOLNO Ci wypisywać nazwy scenariusza (np. "SCENARIUSZ 2").
-        ❌ NIE WOLNO Ci pisać co robisz (np. "Analizuję bazę...").
-        ✅ Pisz TYLKO finalną treść wiadomości.
-        
-        TWOJE ZADANIE - ZIDENTYFIKUJ SCENARIUSZ(NIE WYPISUJ, KTÓRY) I ZACHOWAJ SIĘ ODPOWIEDNIO:
-
-        SCENARIUSZ 1: Użytkownik chce znaleźć/zmienić produkt
-        (np. pisze "ThinkPad", "Pokaż iPhone'a", "Szukam słuchawek", "Jakie są zalety produktu?")
-        -> Wtedy i TYLKO WTEDY użyj narzędzia.
-        -> Zwróć JSON: {{"tool": "get_product_details", "args": {{"product_name": "..."}}}}
-        -> Nie pisz żadnego tekstu, tylko JSON.
-
-        SCENARIUSZ 2: Użytkownik zadaje pytanie o AKTUALNY produkt
-        (np. "Jaki ma ekran?", "Czy jest dobry do gier?", "W jakich kolorach jest dostępny?")
-        -> NIE używaj narzędzia (masz już produkt w kontekście).
-        -> Odpowiedz normalnym tekstem.
-        -> Użyj informacji z historii rozmowy (tam są dane z bazy o cenie/wadach).
-        -> Jeśli w historii brakuje szczegółów technicznych (np. Hz ekranu), użyj swojej WIEDZY OGÓLNEJ.
-
-        SCENARIUSZ 3: Pytania o RAG / Kontekst / Inne
-        (np. "Jaki jest kod rabatowy?", "Co mówi regulamin?", "tajne hasło")
-        -> Sprawdź sekcję "Dodatkowa wiedza (RAG)" powyżej.
-        -> Odpowiedz tekstem na podstawie tej wiedzy.
-
-        ---------------------------------------------------
-        HISTORIA ROZMOWY:
-        {history_str}
-
-        DOSTĘPNE NARZĘDZIA:
-        {TOOLS_DESC}
-        """
-    full_prompt = f"{system_prompt}\n\nHISTORIA ROZMOWY:\n{history_str}\nAsystent:"
-    ai_response_text = generate_ai_response(full_prompt, provider=provider)
-
-    if not ai_response_text:
-        return {
-            "response": "Przepraszam, system AI jest obecnie przeciążony (Limit zapytań). Spróbuj ponownie za minutę.",
-            "provider_used": provider,
-            "rag_context_used": False
-        }
-
-    if guard.check_prompt_leakage(ai_response_text):
-        print("AI próbowało ujawnić System Prompt!")
-        final_answer = "Przepraszam, nie mogę udzielić tej informacji ze względów bezpieczeństwa."
-        return {"response": final_answer, "provider_used": provider, "rag_context_used": False}
-    ai_response_text = guard.sanitize_output(ai_response_text)
-    final_answer = ai_response_text
-    tool_executed = False
-    if '"tool":' in ai_response_text:
-        try:
-            json_match = re.search(r'(\{.*"tool":.*\})', ai_response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-                json_str = re.sub(r'```(?:json)?', '', json_str).replace('```', '').strip()
-                tool_call = json.loads(json_str)
-                tool_name = tool_call.get("tool")
-                tool_args = tool_call.get("args", {})
-
-                if tool_name in TOOLS_MAP:
-                    print(f"🔧 DISPATCHER: Wywołanie {tool_name}...")
-                    tool_result_raw = TOOLS_MAP[tool_name](tool_args)
-                    tool_result_safe = truncate_tool_output(str(tool_result_raw))
-                    try:
-                        res_json = json.loads(tool_result_safe)
-                        if isinstance(res_json,dict) and res_json.get("status") == "error":
-                            code = res_json.get("code")
-                            msg = res_json.get("message")
-                            log_tool_activity(tool_name, "ERROR",f'{code}: {msg}')
-                            if code == "TIMEOUT":
-                                final_answer = "Baza danych odpowiada zbyt wolno."
-                            elif code == "NOT_FOUND":
-                                final_answer = "Nie znalazłem takiego produktu."
-                            else:
-                                final_answer = f"Błąd techniczny: {res_json.get('message')}"
-                        else:
-                            log_tool_activity(tool_name, "OK", "Pobrano dane")
-                            follow_up_prompt = f"""
-                            {system_prompt}
-                            
-                            WYNIK Z BAZY DANYCH:
-                            {tool_result_safe}
-                            
-                            Napisz użytkownikowi JEDNO krótkie zdanie, np. "Oto znaleziony iPhone 15".
-                            NIE WYPISUJ CENY ANI PARAMETRÓW W TEKŚCIE (są w karcie poniżej).
-                            """
-                            ai_intro_text = generate_ai_response(follow_up_prompt, provider=provider)
-                            final_answer = f"{ai_intro_text}\n\n{tool_result_safe}"
-                            tool_executed = True
-                    except json.JSONDecodeError:
-                        log_tool_activity(tool_name, "WARN", "Wynik nie jest JSONem")
-                        final_answer = f"Dane: {tool_result_safe}"
-                else:
-                    final_answer = f"Błąd: Nieznane narzędzie {tool_name}."
-        except Exception as e:
-            print(f"❌ Błąd dispatchera: {e}")
-            final_answer = "Wystąpił błąd podczas przetwarzania zapytania."
-    if not tool_executed:
-        final_answer = guard.sanitize_output(final_answer)
-        source_type = "RAG" if context_faq else "CHAT"
-        log_tool_activity(source_type, "OK", "Wygenerowano odpowiedź tekstową")
-    return {
-        "response": final_answer,
-        "provider_used": provider,
-        "rag_context_used": bool(context_faq)
-    }
-
-if __name__ == "__main__":
-    create_db_and_tables()
-    print("Serwer na http://0.0.0.0:8000")
-
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-
-
+import json
+import re
+import time
+import queue
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+from pydantic import BaseModel
+from database import get_session, engine, create_db_and_tables
+from models import AnalysisStatus
+from search_cache import search_products_cached
+from ai_service import agenerate_ai_response, astream_ai_response, estimate_tokens, router as provider_router
+from rag_engine import rag
+from knowledge_base import knowledge_base
+from tools import TOOLS_MAP, TOOLS_DESC, tool_executor
+from product_repository import get_product_report, get_product_report_by_name
+from analysis_service import on_insight_updated
+from jobs import job_queue, analysis_job_key, batch_job_key, insight_scheduler
+import uvicorn
+from security import guard
+from response_cache import ResponseCache
+from metrics import HTTP_LATENCY, count, render_metrics
+from lifecycle import Startup, StartupStep
+from chat_sessions import ChatMessage, ChatSession, ChatSessionExpired, chat_sessions
+from prompt_budget import PromptStats, compact_history, history_budget
+from intent_router import IntentMatch, IntentRouter
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+startup = Startup()
+# Baza i RAG startują niezależnie: /search i /analyze działają, zanim załaduje się model embeddingów.
+startup.group(
+    StartupStep("database", create_db_and_tables, retry=True),
+    StartupStep("jobs", job_queue.resume_pending),
+    StartupStep("scheduler", insight_scheduler.start),
+)
+startup.group(
+    StartupStep("embedder", rag.warm_up, retry=True),
+    StartupStep("knowledge_base", knowledge_base.start),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener.start()
+    startup.start()
+    yield
+    startup.stop()
+    knowledge_base.stop()
+    insight_scheduler.stop()
+    job_queue.stop()
+    log_listener.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+origins = [
+    "http://localhost:8051",
+    "http://127.0.0.1:8051",
+    "*"  
+]
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+tool_logger = logging.getLogger("tool_logger")
+tool_logger.setLevel(logging.INFO)
+tool_logger.propagate = False
+
+file_handler = logging.FileHandler("tools_activity.log", mode="a", encoding="utf-8", delay=True)
+formatter = logging.Formatter('%(asctime)s | %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+file_handler.setFormatter(formatter)
+# Zapis do pliku w osobnym wątku - obsługa zapytania tylko wrzuca rekord do kolejki.
+log_queue = queue.SimpleQueue()
+tool_logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, file_handler)
+
+def log_tool_activity(tool_name, status, details = "-"):
+    tool_logger.info(f"{tool_name} | {status} | {details}")
+
+response_cache = ResponseCache()
+intent_router = IntentRouter(encoder=rag.try_encode)
+on_insight_updated(lambda product: response_cache.invalidate_product(product.name))
+
+@app.middleware("http")
+async def http_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_LATENCY.labels(request.method, route.path if route else "unmatched", str(status)).observe(
+            time.perf_counter() - start)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/health/live")
+def liveness_endpoint():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness_endpoint(response: Response):
+    state = startup.snapshot()
+    if not state["ready"]:
+        response.status_code = 503
+    return state
+
+class SearchQuery(BaseModel):
+    query: str
+    gl: str = "pl"
+    hl: str = "pl"
+    
+class AnalyzeRequest(BaseModel):
+    name: str
+    price: float
+    image_url: str
+    link: str
+
+class BatchAnalyzeRequest(BaseModel):
+    products: list[AnalyzeRequest]
+    analyze: bool = True
+
+class Message(BaseModel):
+    role: str  
+    content: str
+
+class ChatRequest(BaseModel):
+    messages: list[Message] = []
+    message: str | None = None
+    session_id: str | None = None
+    provider: str = "auto"
+    active_product_name: str | None = None
+
+@app.post("/search")
+def search_endpoint(req: SearchQuery):
+    results = search_products_cached(req.query, req.gl, req.hl)
+    return {"results": results}
+
+
+@app.post("/analyze")
+def analyze_endpoint(req: AnalyzeRequest, db: Session = Depends(get_session)):
+    existing = get_product_report_by_name(db, req.name)
+    if existing:
+        job_id = None
+        if not existing.has_insight or existing.insight_status == AnalysisStatus.NONE:
+            job_id, _ = job_queue.submit(analysis_job_key(req.name), {"product_id": existing.id}, product_id=existing.id)
+        return {"message": "Produkt pobrany z cache", "id": existing.id, "job_id": job_id}
+    job_id, created = job_queue.submit(analysis_job_key(req.name), req.model_dump())
+    message = "Rozpoczęto pobieranie i analizę produktu" if created else "Analiza tego produktu już trwa"
+    return {"message": message, "id": None, "job_id": job_id}
+
+
+@app.post("/analyze/batch")
+def analyze_batch_endpoint(req: BatchAnalyzeRequest):
+    # Cała paczka to jedno zadanie w tle - statystyki i wyniki po indeksie wejścia przez GET /jobs/{job_id}.
+    products = [p.model_dump() for p in req.products]
+    job_id, created = job_queue.submit(batch_job_key([p["name"] for p in products]),
+                                       {"mode": "batch", "products": products, "analyze": req.analyze})
+    message = "Rozpoczęto import paczki produktów" if created else "Import tej paczki już trwa"
+    return {"message": message, "job_id": job_id, "requested": len(products)}
+
+
+@app.post("/insights/refresh")
+def refresh_insights_endpoint():
+    return {"queued": insight_scheduler.run_once()}
+
+
+@app.post("/admin/knowledge/refresh")
+def refresh_knowledge_endpoint():
+    return knowledge_base.refresh()
+
+
+@app.get("/admin/knowledge")
+def knowledge_status_endpoint():
+    return knowledge_base.snapshot()
+
+
+@app.get("/admin/providers")
+def providers_status_endpoint():
+    return provider_router.snapshot()
+
+
+@app.get("/admin/tools")
+def tools_status_endpoint():
+    return tool_executor.snapshot()
+
+
+@app.get("/jobs/{job_id}")
+def job_status_endpoint(job_id: int):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Nie znaleziono zadania.")
+    return {
+        "id": job.id,
+        "status": job.status,
+        "product_id": job.product_id,
+        "attempts": job.attempts,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at
+    }
+
+
+@app.get("/products/{product_id}/insight")
+def product_insight_endpoint(product_id: int, db: Session = Depends(get_session)):
+    report = get_product_report(db, product_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Nie znaleziono produktu.")
+    return {
+        "product_id": report.id,
+        "name": report.name,
+        "status": report.insight_status or AnalysisStatus.NONE,
+        "summary": report.summary,
+        "pros": report.pros,
+        "cons": report.cons
+    }
+
+
+MAX_TOOL_OUTPUT_CHARS = 8000
+
+def truncate_tool_output(output: str, max_len: int = MAX_TOOL_OUTPUT_CHARS) -> str:
+    if len(output) > max_len:
+        return output[:max_len] + f"\n... [Przycięto {len(output)-max_len} znaków]"
+    return output
+def validate_chat_message(last_user_msg: str) -> str:
+    blocked = guard.check_input(last_user_msg)
+    if blocked == "path":
+        raise HTTPException(status_code=400, detail="Wykryto niedozwolone znaki w zapytaniu.")
+
+    if blocked:
+        raise HTTPException(status_code=400, detail="Zapytanie zablokowane.")
+    return last_user_msg
+
+# Nowi klienci wysyłają tylko `message` (+ session_id), historia jest trzymana po stronie serwera.
+# Stary format z pełną listą `messages` nadal działa na jednorazowej, niezapisywanej sesji.
+# Nieznany lub wygasły session_id to błąd (404/410), a nie po cichu nowa, pusta rozmowa.
+def open_chat_session(req: ChatRequest) -> tuple[ChatSession, str]:
+    if req.message is not None:
+        try:
+            session = chat_sessions.get(req.session_id) if req.session_id else chat_sessions.create()
+        except ChatSessionExpired:
+            raise HTTPException(status_code=410, detail="Sesja czatu wygasła. Rozpocznij nową rozmowę.")
+        if session is None:
+            raise HTTPException(status_code=404, detail="Nie znaleziono sesji czatu.")
+        last_user_msg = validate_chat_message(req.message)
+    else:
+        session = ChatSession(id="", messages=[ChatMessage(m.role, m.content) for m in req.messages[:-1]])
+        last_user_msg = validate_chat_message(req.messages[-1].content if req.messages else "")
+    if req.active_product_name:
+        session.active_product_name = req.active_product_name
+    session.append("user", last_user_msg)
+    return session, last_user_msg
+
+def build_chat_prompt(session: ChatSession, rag_context: str) -> tuple[str, str, PromptStats]:
+    system_prompt = f"""
+        Jesteś Inteligentnym Asystentem Zakupowym. Twoim celem jest pomóc użytkownikowi w zakupach, łącząc twarde dane z bazy z twoją wiedzą ogólną.
+
+        ---------------------------------------------------
+        AKTUALNY KONTEKST:
+        - Użytkownik przegląda teraz produkt: "{session.active_product_name if session.active_product_name else 'Brak'}"
+        - Dodatkowa wiedza (RAG/Sekrety): {rag_context}
+        ---------------------------------------------------
+        ZASADA CARDINALNA (NAJWAŻNIEJSZA):
+        Twoja odpowiedź trafia BEZPOŚREDNIO do klienta na czacie.
+        ❌ NIE WOLNO Ci wypisywać nazwy scenariusza (np. "SCENARIUSZ 2").
+        ❌ NIE WOLNO Ci pisać co robisz (np. "Analizuję bazę...").
+        ✅ Pisz TYLKO finalną treść wiadomości.
+        
+        TWOJE ZADANIE - ZIDENTYFIKUJ SCENARIUSZ(NIE WYPISUJ, KTÓRY) I ZACHOWAJ SIĘ ODPOWIEDNIO:
+
+        SCENARIUSZ 1: Użytkownik chce znaleźć/zmienić produkt
+        (np. pisze "ThinkPad", "Pokaż iPhone'a", "Szukam słuchawek", "Jakie są zalety produktu?")
+        -> Wtedy i TYLKO WTEDY użyj narzędzia.
+        -> Zwróć JSON: {{"tool": "get_product_details", "args": {{"product_name": "..."}}}}
+        -> Nie pisz żadnego tekstu, tylko JSON.
+
+        SCENARIUSZ 2: Użytkownik zadaje pytanie o AKTUALNY produkt
+        (np. "Jaki ma ekran?", "Czy jest dobry do gier?", "W jakich kolorach jest dostępny?")
+        -> NIE używaj narzędzia (masz już produkt w kontekście).
+        -> Odpowiedz normalnym tekstem.
+        -> Użyj informacji z historii rozmowy (tam są dane z bazy o cenie/wadach).
+        -> Jeśli w historii brakuje szczegółów technicznych (np. Hz ekranu), użyj swojej WIEDZY OGÓLNEJ.
+
+        SCENARIUSZ 3: Pytania o RAG / Kontekst / Inne
+        (np. "Jaki jest kod rabatowy?", "Co mówi regulamin?", "tajne hasło")
+        -> Sprawdź sekcję "Dodatkowa wiedza (RAG)" powyżej.
+        -> Odpowiedz tekstem na podstawie tej wiedzy.
+
+        ---------------------------------------------------
+        DOSTĘPNE NARZĘDZIA:
+        {TOOLS_DESC}
+        """
+    history = compact_history(session.messages, history_budget(system_prompt), session.compacted, session.offset)
+    full_prompt = f"{system_prompt}\n\nHISTORIA ROZMOWY:\n{history.text}\nAsystent:"
+    stats = PromptStats(estimate_tokens(full_prompt), history.tokens, history.raw_tokens, history.dropped)
+    print(f"📏 Prompt: {stats.tokens} tokenów (historia {stats.raw_history_tokens} -> {stats.history_tokens}, "
+          f"pominięto wiadomości: {stats.dropped_messages})")
+    return system_prompt, full_prompt, stats
+
+def build_follow_up_prompt(system_prompt: str, tool_result_safe: str) -> str:
+    return f"""
+                            {system_prompt}
+                            
+                            WYNIK Z BAZY DANYCH:
+                            {tool_result_safe}
+                            
+                            Napisz użytkownikowi JEDNO krótkie zdanie, np. "Oto znaleziony iPhone 15".
+                            NIE WYPISUJ CENY ANI PARAMETRÓW W TEKŚCIE (są w karcie poniżej).
+                            """
+
+# Zwraca (wynik narzędzia, odpowiedź błędu); (None, None) gdy odpowiedź nie zawiera wywołania narzędzia.
+async def execute_tool_call(ai_response_text: str) -> tuple[str | None, str | None]:
+    try:
+        json_match = re.search(r'(\{.*"tool":.*\})', ai_response_text, re.DOTALL)
+        if not json_match:
+            return None, None
+        json_str = json_match.group(1)
+        json_str = re.sub(r'```(?:json)?', '', json_str).replace('```', '').strip()
+        tool_call = json.loads(json_str)
+        return await run_tool(tool_call.get("tool"), tool_call.get("args", {}))
+    except Exception as e:
+        print(f"❌ Błąd dispatchera: {e}")
+        return None, "Wystąpił błąd podczas przetwarzania zapytania."
+
+async def run_tool(tool_name: str, tool_args: dict) -> tuple[str | None, str | None]:
+    try:
+        if tool_name not in TOOLS_MAP:
+            return None, f"Błąd: Nieznane narzędzie {tool_name}."
+        print(f"🔧 DISPATCHER: Wywołanie {tool_name}...")
+        tool_result_raw = await TOOLS_MAP[tool_name].arun(tool_args)
+        tool_result_safe = truncate_tool_output(str(tool_result_raw))
+        try:
+            res_json = json.loads(tool_result_safe)
+        except json.JSONDecodeError:
+            log_tool_activity(tool_name, "WARN", "Wynik nie jest JSONem")
+            return None, f"Dane: {tool_result_safe}"
+        if isinstance(res_json,dict) and res_json.get("status") == "error":
+            code = res_json.get("code")
+            msg = res_json.get("message")
+            log_tool_activity(tool_name, "ERROR",f'{code}: {msg}')
+            if code == "TIMEOUT":
+                return None, "Baza danych odpowiada zbyt wolno."
+            elif code == "NOT_FOUND":
+                return None, "Nie znalazłem takiego produktu."
+            return None, f"Błąd techniczny: {res_json.get('message')}"
+        log_tool_activity(tool_name, "OK", "Pobrano dane")
+        return tool_result_safe, None
+    except Exception as e:
+        print(f"❌ Błąd dispatchera: {e}")
+        return None, "Wystąpił błąd podczas przetwarzania zapytania."
+
+async def answer_routed(session: ChatSession, last_user_msg: str) -> tuple[str, IntentMatch] | None:
+    # Oczywiste wywołanie narzędzia bez pierwszego zapytania do LLM; wstęp z szablonu zamiast drugiego.
+    match = await run_in_threadpool(intent_router.route, last_user_msg, session.messages[:-1],
+                                    session.active_product_name)
+    if match is None:
+        return None
+    tool_result_safe, _ = await run_tool(match.tool, match.args)
+    if tool_result_safe is None:
+        # Router mógł źle odczytać pytanie (np. brak takiego produktu) - wtedy decyduje LLM jak dotąd.
+        count("router", match.tool, "fallback")
+        return None
+    count("router", match.tool, match.source)
+    log_tool_activity("ROUTER", "OK", f"{match.tool} ({match.source})")
+    intro = guard.sanitize_output(IntentRouter.intro(match, json.loads(tool_result_safe)))
+    if match.tool == "calculate_installment":
+        return intro, match
+    return f"{intro}\n\n{tool_result_safe}", match
+
+def routed_result(answer: str, match: IntentMatch) -> dict:
+    return {"response": answer, "provider_used": "router", "rag_context_used": False, "intent": match.as_dict()}
+
+def report_product_name(tool_result_safe: str) -> list:
+    try:
+        data = json.loads(tool_result_safe)
+        return [data["name"]] if isinstance(data, dict) and data.get("name") else []
+    except (json.JSONDecodeError, TypeError):
+        return []
+
+OVERLOADED_ANSWER = "Przepraszam, system AI jest obecnie przeciążony (Limit zapytań). Spróbuj ponownie za minutę."
+LEAK_ANSWER = "Przepraszam, nie mogę udzielić tej informacji ze względów bezpieczeństwa."
+
+@app.post("/chat")
+async def chat_endpoint(req: ChatRequest):
+    session, last_user_msg = await run_in_threadpool(open_chat_session, req)
+    result = await answer_chat(session, last_user_msg, req.provider)
+    session.append("assistant", result["response"])
+    await run_in_threadpool(chat_sessions.save, session)
+    result["session_id"] = session.id or None
+    return result
+
+async def answer_chat(session: ChatSession, last_user_msg: str, provider: str) -> dict:
+    routed = await answer_routed(session, last_user_msg)
+    if routed is not None:
+        return routed_result(*routed)
+    rag_context, query_vec = await run_in_threadpool(rag.retrieve, last_user_msg, 2)
+    context_faq = rag_context
+    history = session.messages[:-1]
+    cached = response_cache.get(last_user_msg, session.active_product_name, rag_context, history, query_vec)
+    if cached is not None:
+        log_tool_activity("CACHE", "HIT", "Odpowiedź z cache")
+        return {"response": cached, "provider_used": "cache", "rag_context_used": bool(context_faq)}
+    system_prompt, full_prompt, prompt_stats = build_chat_prompt(session, rag_context)
+    ai_response_text = await agenerate_ai_response(full_prompt, provider=provider)
+
+    if not ai_response_text:
+        return {
+            "response": OVERLOADED_ANSWER,
+            "provider_used": provider,
+            "rag_context_used": False
+        }
+
+    leaked, ai_response_text = guard.scan_output(ai_response_text)
+    if leaked:
+        print("AI próbowało ujawnić System Prompt!")
+        return {"response": LEAK_ANSWER, "provider_used": provider, "rag_context_used": False}
+    final_answer = ai_response_text
+    tool_executed = False
+    cacheable = True
+    related_products = []
+    if '"tool":' in ai_response_text:
+        tool_result_safe, error_answer = await execute_tool_call(ai_response_text)
+        if tool_result_safe is not None:
+            ai_intro_text = await agenerate_ai_response(build_follow_up_prompt(system_prompt, tool_result_safe), provider=provider)
+            final_answer = f"{ai_intro_text}\n\n{tool_result_safe}"
+            tool_executed = True
+            cacheable = ai_intro_text is not None
+            related_products = report_product_name(tool_result_safe)
+        elif error_answer is not None:
+            final_answer = guard.sanitize_output(error_answer)
+            cacheable = False
+    if not tool_executed:
+        source_type = "RAG" if context_faq else "CHAT"
+        log_tool_activity(source_type, "OK", "Wygenerowano odpowiedź tekstową")
+    if cacheable:
+        response_cache.put(last_user_msg, session.active_product_name, rag_context, final_answer, related_products,
+                           history, query_vec)
+    return {
+        "response": final_answer,
+        "provider_used": provider,
+        "rag_context_used": bool(context_faq),
+        "prompt_tokens": prompt_stats.as_dict()
+    }
+
+@app.delete("/chat/sessions/{session_id}")
+def delete_chat_session_endpoint(session_id: str):
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Nie znaleziono sesji.")
+    return {"deleted": session_id}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def save_before_done(session: ChatSession, stream):
+    # Zapis sesji przed zdarzeniem "done" - następna tura klienta (na dowolnym workerze) widzi już tę odpowiedź.
+    async for event in stream:
+        if event.startswith("event: done"):
+            await run_in_threadpool(chat_sessions.save, session)
+        yield event
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    session, last_user_msg = await run_in_threadpool(open_chat_session, req)
+    provider = req.provider
+
+    def done_event(data: dict) -> str:
+        session.append("assistant", data["response"])
+        data["session_id"] = session.id or None
+        return sse_event("done", data)
+
+    routed = await answer_routed(session, last_user_msg)
+    if routed is not None:
+        async def routed_stream():
+            yield sse_event("token", {"text": routed[0]})
+            yield done_event(routed_result(*routed))
+        return StreamingResponse(save_before_done(session, routed_stream()), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    rag_context, query_vec = await run_in_threadpool(rag.retrieve, last_user_msg, 2)
+    system_prompt, full_prompt, prompt_stats = build_chat_prompt(session, rag_context)
+    history = session.messages[:-1]
+    cached = response_cache.get(last_user_msg, session.active_product_name, rag_context, history, query_vec)
+
+    async def event_stream():
+        if cached is not None:
+            log_tool_activity("CACHE", "HIT", "Odpowiedź z cache (stream)")
+            yield sse_event("token", {"text": cached})
+            yield done_event({"response": cached, "provider_used": "cache", "rag_context_used": bool(rag_context)})
+            return
+        stream_guard = guard.stream()
+        pending = ""
+        tool_mode = None
+        async for chunk in astream_ai_response(full_prompt, provider=provider):
+            if tool_mode is None:
+                pending += chunk
+                head = pending.lstrip()
+                if not head:
+                    continue
+                # Odpowiedź z narzędziem to sam JSON - buforujemy ją w całości zamiast streamować.
+                tool_mode = head[0] in "{`"
+                chunk, pending = pending, ""
+            if tool_mode:
+                pending += chunk
+                continue
+            safe = stream_guard.feed(chunk)
+            if stream_guard.leaked:
+                print("AI próbowało ujawnić System Prompt!")
+                yield sse_event("replace", {"text": LEAK_ANSWER})
+                yield done_event({"response": LEAK_ANSWER, "provider_used": provider, "rag_context_used": False})
+                return
+            if safe:
+                yield sse_event("token", {"text": safe})
+
+        if not tool_mode:
+            tail = stream_guard.flush()
+            if tail:
+                yield sse_event("token", {"text": tail})
+            if not stream_guard.text:
+                yield sse_event("replace", {"text": OVERLOADED_ANSWER})
+                yield done_event({"response": OVERLOADED_ANSWER, "provider_used": provider, "rag_context_used": False})
+                return
+            log_tool_activity("RAG" if rag_context else "CHAT", "OK", "Wygenerowano odpowiedź tekstową (stream)")
+            response_cache.put(last_user_msg, session.active_product_name, rag_context, stream_guard.output,
+                               history=history, vector=query_vec)
+            yield done_event({"response": stream_guard.output, "provider_used": provider,
+                                     "rag_context_used": bool(rag_context), "prompt_tokens": prompt_stats.as_dict()})
+            return
+
+        leaked, ai_response_text = guard.scan_output(pending)
+        if leaked:
+            print("AI próbowało ujawnić System Prompt!")
+            yield sse_event("replace", {"text": LEAK_ANSWER})
+            yield done_event({"response": LEAK_ANSWER, "provider_used": provider, "rag_context_used": False})
+            return
+        tool_result_safe, error_answer = (None, None)
+        if '"tool":' in ai_response_text:
+            tool_result_safe, error_answer = await execute_tool_call(ai_response_text)
+        if tool_result_safe is None:
+            final_answer = guard.sanitize_output(error_answer) if error_answer is not None else ai_response_text
+            yield sse_event("replace", {"text": final_answer})
+            yield done_event({"response": final_answer, "provider_used": provider, "rag_context_used": bool(rag_context)})
+            return
+
+        intro_guard = guard.stream()
+        async for chunk in astream_ai_response(build_follow_up_prompt(system_prompt, tool_result_safe), provider=provider):
+            safe = intro_guard.feed(chunk)
+            if intro_guard.leaked:
+                break
+            if safe:
+                yield sse_event("token", {"text": safe})
+        tail = "" if intro_guard.leaked else intro_guard.flush()
+        if tail:
+            yield sse_event("token", {"text": tail})
+        intro = "" if intro_guard.leaked else intro_guard.output
+        final_answer = f"{intro}\n\n{tool_result_safe}"
+        if intro:
+            response_cache.put(last_user_msg, session.active_product_name, rag_context, final_answer,
+                               report_product_name(tool_result_safe), history, query_vec)
+        yield done_event({"response": final_answer, "provider_used": provider,
+                                 "rag_context_used": bool(rag_context), "prompt_tokens": prompt_stats.as_dict()})
+
+    return StreamingResponse(save_before_done(session, event_stream()), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+if __name__ == "__main__":
+    create_db_and_tables()
+    print("Serwer na http://0.0.0.0:8000")
+
+    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+
@@ -0,0 +1,61 @@
+import time
+import contextlib
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_LATENCY = Histogram(
+    "praicer_stage_duration_seconds", "Czas etapów obsługi zapytania (RAG, LLM, narzędzia, baza, scraper).",
+    ["stage", "name"], buckets=STAGE_BUCKETS
+)
+STAGE_CALLS = Counter("praicer_stage_calls_total", "Liczba wywołań etapów wg wyniku.", ["stage", "name", "outcome"])
+HTTP_LATENCY = Histogram(
+    "praicer_http_request_duration_seconds", "Czas obsługi żądań HTTP.",
+    ["method", "route", "status"], buckets=STAGE_BUCKETS
+)
+
+
+def observe(stage: str, name: str, seconds: float | None, ok: bool = True):
+    if seconds is not None:
+        STAGE_LATENCY.labels(stage, name).observe(seconds)
+    count(stage, name, "ok" if ok else "error")
+
+
+def count(stage: str, name: str, outcome: str):
+    STAGE_CALLS.labels(stage, name, outcome).inc()
+
+
+@contextlib.contextmanager
+def track(stage: str, name: str = "-"):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        observe(stage, name, time.perf_counter() - start, ok=False)
+        raise
+    observe(stage, name, time.perf_counter() - start)
+
+
+def instrument_engine(engine):
+    # Czas każdego zapytania SQL, etykieta to rodzaj instrukcji (SELECT/INSERT/...), żeby nie mnożyć serii.
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        observe("db", statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "-",
+                time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        observe("db", "error", None, ok=False)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,46 +1,88 @@
-from typing import Optional, List
-from datetime import datetime
-from sqlmodel import Field, Relationship, SQLModel
-from enum import Enum
-
-class AnalysisStatus(str, Enum):
-    NONE = "none",
-    PROCESSING = "processing",
-    COMPLETED = "completed",
-    ERROR = "error"
-
-class Product(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
-    price: float
-    image_url: Optional[str] = None
-    reviews: List["Review"] = Relationship(back_populates="product")
-    offers: List["Offer"] = Relationship(back_populates="product")
-    insights: Optional["Insight"] = Relationship(back_populates="product")
-
-class Review(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    product_id: int = Field(foreign_key="product.id")
-    content: str
-    rating: float
-    source: str = "unknown"
-    product: Product = Relationship(back_populates="reviews")
-
-class Insight(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    product_id: int = Field(foreign_key="product.id", unique=True)
-    status: AnalysisStatus = Field(AnalysisStatus.NONE)
-    summary: Optional[str] = None
-    pros: Optional[str] = None
-    cons: Optional[str] = None
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
-    product: Product = Relationship(back_populates="insights")
-
-class Offer(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    product_id: int = Field(foreign_key="product.id")
-    store_name: Optional[str] = None
-    price: float
-    link: Optional[str] = None
-
-    product: Optional[Product] = Relationship(back_populates="offers")
\ No newline at end of file
+from typing import Optional, List
+from datetime import datetime
+from sqlmodel import Field, Relationship, SQLModel
+from enum import Enum
+
+class AnalysisStatus(str, Enum):
+    NONE = "none",
+    PROCESSING = "processing",
+    COMPLETED = "completed",
+    ERROR = "error"
+
+class Product(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str
+    price: float
+    image_url: Optional[str] = None
+    scraped_at: Optional[datetime] = None
+    reviews: List["Review"] = Relationship(back_populates="product")
+    offers: List["Offer"] = Relationship(back_populates="product")
+    insights: Optional["Insight"] = Relationship(back_populates="product")
+
+class Review(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    product_id: int = Field(foreign_key="product.id")
+    content: str
+    rating: float
+    source: str = "unknown"
+    duplicates: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    product: Product = Relationship(back_populates="reviews")
+
+class Insight(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    product_id: int = Field(foreign_key="product.id", unique=True)
+    status: AnalysisStatus = Field(AnalysisStatus.NONE)
+    summary: Optional[str] = None
+    pros: Optional[str] = None
+    cons: Optional[str] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    input_hash: Optional[str] = None
+    last_review_id: Optional[int] = None
+    review_count: Optional[int] = None
+    last_offer_id: Optional[int] = None
+    product: Product = Relationship(back_populates="insights")
+
+class Offer(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    product_id: int = Field(foreign_key="product.id")
+    store_name: Optional[str] = None
+    price: float
+    link: Optional[str] = None
+
+    product: Optional[Product] = Relationship(back_populates="offers")
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    ERROR = "error"
+
+class AnalysisJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    dedup_key: str = Field(index=True)
+    payload: str
+    status: JobStatus = Field(JobStatus.QUEUED, index=True)
+    product_id: Optional[int] = Field(default=None, foreign_key="product.id")
+    attempts: int = 0
+    error: Optional[str] = None
+    result: Optional[str] = None
+    worker: Optional[str] = None
+    lease_until: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SearchCacheEntry(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    query: str
+    gl: str
+    hl: str
+    results: str
+    fetched_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ChatSessionRecord(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    messages: str = "[]"
+    active_product_name: Optional[str] = None
+    offset: int = 0
+    version: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
@@ -0,0 +1,75 @@
+from dataclasses import dataclass, field
+from sqlmodel import Session, select
+from models import Product, Offer, Insight, AnalysisStatus
+from product_search import best_candidate_subquery, has_trgm, search_product_candidates
+
+
+@dataclass(frozen=True)
+class OfferView:
+    store_name: str | None
+    price: float
+    link: str | None
+
+
+@dataclass(frozen=True)
+class ProductReport:
+    id: int
+    name: str
+    price: float
+    image_url: str | None
+    insight_status: AnalysisStatus | None = None
+    summary: str | None = None
+    pros: str | None = None
+    cons: str | None = None
+    offers: list[OfferView] = field(default_factory=list)
+
+    @property
+    def has_insight(self) -> bool:
+        return self.insight_status is not None
+
+
+def _report_statement():
+    # Jedno zapytanie z LEFT JOIN na oferty i analizę, bez hydratacji obiektów ORM.
+    return (
+        select(
+            Product.id, Product.name, Product.price, Product.image_url,
+            Insight.status, Insight.summary, Insight.pros, Insight.cons,
+            Offer.id, Offer.store_name, Offer.price, Offer.link,
+        )
+        .outerjoin(Insight, Insight.product_id == Product.id)
+        .outerjoin(Offer, Offer.product_id == Product.id)
+        .order_by(Offer.id)
+    )
+
+
+def _to_report(rows) -> ProductReport | None:
+    if not rows:
+        return None
+    first = rows[0]
+    offers = [OfferView(store_name=r[9], price=float(r[10]), link=r[11]) for r in rows if r[8] is not None]
+    return ProductReport(
+        id=first[0], name=first[1], price=float(first[2]), image_url=first[3],
+        insight_status=first[4], summary=first[5], pros=first[6], cons=first[7],
+        offers=offers,
+    )
+
+
+def get_product_report(session: Session, product_id: int) -> ProductReport | None:
+    return _to_report(session.exec(_report_statement().where(Product.id == product_id)).all())
+
+
+def get_product_report_by_name(session: Session, name: str) -> ProductReport | None:
+    rows = session.exec(_report_statement().where(Product.name == name)).all()
+    if not rows:
+        return None
+    return _to_report([r for r in rows if r[0] == rows[0][0]])
+
+
+def find_product_report(session: Session, search_term: str) -> ProductReport | None:
+    if not search_term.strip():
+        return None
+    if has_trgm(session):
+        # Wyszukanie i raport w jednym zapytaniu; bez pg_trgm ranking liczymy w Pythonie, więc są dwa.
+        return _to_report(session.exec(_report_statement().where(Product.id == best_candidate_subquery(search_term))).all())
+    candidates = search_product_candidates(session, search_term, limit=1)
+    return get_product_report(session, candidates[0].id) if candidates else None
@@ -0,0 +1,89 @@
+import re
+import threading
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from sqlalchemy import func, literal, or_, text
+from sqlmodel import Session, select
+from models import Product
+
+SEARCH_LIMIT = 5
+
+_trgm_lock = threading.Lock()
+_trgm_available = None
+
+
+@dataclass
+class ProductCandidate:
+    id: int
+    name: str
+    score: float
+
+
+def ensure_search_index(engine):
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_product_name_trgm ON product USING gin (lower(name) gin_trgm_ops)"
+            ))
+    except Exception as e:
+        print(f"⚠️ Wyszukiwarka: Brak indeksu trigramowego, używam ILIKE: {e}")
+
+
+def has_trgm(session: Session) -> bool:
+    global _trgm_available
+    if _trgm_available is None:
+        with _trgm_lock:
+            if _trgm_available is None:
+                if session.get_bind().dialect.name != "postgresql":
+                    _trgm_available = False
+                else:
+                    row = session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+                    _trgm_available = row is not None
+    return _trgm_available
+
+
+def _like_pattern(term: str) -> str:
+    return "%" + re.sub(r"([%_\\])", r"\\\1", term) + "%"
+
+
+def search_product_candidates(session: Session, search_term: str, limit: int = SEARCH_LIMIT) -> list[ProductCandidate]:
+    term = search_term.strip().lower()
+    if not term:
+        return []
+
+    if has_trgm(session):
+        # `<%` i LIKE korzystają z indeksu GIN; ranking po word_similarity premiuje nazwę zawierającą frazę.
+        rows = session.execute(text("""
+            SELECT id, name, word_similarity(:term, lower(name)) AS score
+            FROM product
+            WHERE :term <% lower(name) OR lower(name) LIKE :pattern
+            ORDER BY score DESC, similarity(:term, lower(name)) DESC, id DESC
+            LIMIT :limit
+        """), {"term": term, "pattern": _like_pattern(term), "limit": limit}).all()
+        return [ProductCandidate(id=r.id, name=r.name, score=float(r.score)) for r in rows]
+
+    statement = select(Product.id, Product.name).where(Product.name.ilike(_like_pattern(term), escape="\\")).order_by(
+        Product.id.desc()).limit(limit * 10)
+    candidates = [
+        ProductCandidate(id=pid, name=name, score=SequenceMatcher(None, term, name.lower()).ratio())
+        for pid, name in session.exec(statement).all()
+    ]
+    candidates.sort(key=lambda c: c.score, reverse=True)
+    return candidates[:limit]
+
+
+def best_candidate_subquery(search_term: str):
+    # Ten sam ranking co search_product_candidates (pg_trgm), ale jako podzapytanie do złożenia z raportem produktu.
+    term = search_term.strip().lower()
+    name = func.lower(Product.name)
+    return (
+        select(Product.id)
+        .where(or_(literal(term).op("<%")(name), name.like(_like_pattern(term))))
+        .order_by(func.word_similarity(term, name).desc(), func.similarity(term, name).desc(), Product.id.desc())
+        .limit(1)
+        .correlate(None)
+        .scalar_subquery()
+    )
@@ -0,0 +1,118 @@
+import os
+import re
+import json
+from dataclasses import dataclass
+from ai_service import estimate_tokens
+
+CHAT_PROMPT_TOKENS = int(os.getenv("CHAT_PROMPT_TOKENS", "6000"))
+CHAT_MIN_HISTORY_TOKENS = int(os.getenv("CHAT_MIN_HISTORY_TOKENS", "500"))
+CHAT_OLD_MESSAGE_CHARS = int(os.getenv("CHAT_OLD_MESSAGE_CHARS", "400"))
+CHAT_RECENT_MESSAGES = int(os.getenv("CHAT_RECENT_MESSAGES", "4"))
+
+
+@dataclass
+class HistoryWindow:
+    text: str
+    tokens: int
+    raw_tokens: int
+    dropped: int
+
+
+@dataclass
+class PromptStats:
+    tokens: int
+    history_tokens: int
+    raw_history_tokens: int
+    dropped_messages: int
+
+    def as_dict(self) -> dict:
+        return {
+            "prompt_tokens": self.tokens,
+            "history_tokens": self.history_tokens,
+            "raw_history_tokens": self.raw_history_tokens,
+            "dropped_messages": self.dropped_messages
+        }
+
+
+def _role_prefix(role: str) -> str:
+    return "Użytkownik" if role == "user" else "Asystent"
+
+
+def split_product_card(content: str) -> tuple[str, dict | None]:
+    if '"type": "product_report"' not in content:
+        return content, None
+    start, end = content.find("{"), content.rfind("}") + 1
+    try:
+        card = json.loads(content[start:end])
+    except json.JSONDecodeError:
+        return content, None
+    if not isinstance(card, dict) or card.get("type") != "product_report":
+        return content, None
+    return content[:start].strip(), card
+
+
+def compact_card(card: dict, full: bool) -> str:
+    # Najnowsza karta zostaje z faktami z bazy, starsze skracamy do jednej linii - pełny JSON (oferty, linki, obrazki) jest zbędny dla modelu.
+    if not full:
+        return f"[Karta produktu: {card.get('name')} | cena: {card.get('price')} zł]"
+    offers = card.get("offers") or []
+    prices = [o["price"] for o in offers if isinstance(o, dict) and o.get("price")]
+    lines = [
+        f"[Karta produktu: {card.get('name')}]",
+        f"- Cena: {card.get('price')} zł" + (f" (oferty: {len(prices)}, od {min(prices)} zł)" if prices else ""),
+        f"- Podsumowanie opinii: {card.get('summary')}",
+        f"- Zalety: {card.get('pros')}",
+        f"- Wady: {card.get('cons')}",
+    ]
+    return "\n".join(lines)
+
+
+def compact_message(role: str, content: str, recent: bool, latest_card: bool) -> str:
+    text, card = split_product_card(content or "")
+    text = re.sub(r"[ \t]+", " ", text).strip()
+    if not recent and len(text) > CHAT_OLD_MESSAGE_CHARS:
+        text = text[:CHAT_OLD_MESSAGE_CHARS] + "…"
+    if card is not None:
+        text = (text + "\n" if text else "") + compact_card(card, latest_card)
+    return f"{_role_prefix(role)}: {text}"
+
+
+def compact_history(messages: list, budget: int, cache: dict | None = None, offset: int = 0) -> HistoryWindow:
+    raw = "".join(f"{_role_prefix(m.role)}: {m.content}\n" for m in messages)
+    latest_card_at = next(
+        (i for i in range(len(messages) - 1, -1, -1)
+         if messages[i].role != "user" and split_product_card(messages[i].content or "")[1]),
+        -1
+    )
+    recent_from = len(messages) - CHAT_RECENT_MESSAGES
+
+    # Od najnowszej wiadomości wstecz, dopóki mieści się w budżecie; ostatnia wiadomość zawsze trafia do promptu.
+    kept, used = [], 0
+    limit = budget - 16  # miejsce na notkę o pominiętych wiadomościach
+    for i in range(len(messages) - 1, -1, -1):
+        key = (offset + i, i >= recent_from, i == latest_card_at)
+        line = cache.get(key) if cache is not None else None
+        if line is None:
+            line = compact_message(messages[i].role, messages[i].content, key[1], key[2]) + "\n"
+            if cache is not None:
+                cache[key] = line
+        cost = estimate_tokens(line)
+        if kept and used + cost > limit:
+            break
+        if not kept and cost > budget:
+            line = line[:budget * 4] + "…\n"
+            cost = estimate_tokens(line)
+        kept.append(line)
+        used += cost
+    kept.reverse()
+
+    dropped = len(messages) - len(kept)
+    if dropped:
+        note = f"[Pominięto {dropped} starszych wiadomości rozmowy.]\n"
+        kept.insert(0, note)
+        used += estimate_tokens(note)
+    return HistoryWindow(text="".join(kept), tokens=used, raw_tokens=estimate_tokens(raw), dropped=dropped)
+
+
+def history_budget(fixed_text: str, total: int = CHAT_PROMPT_TOKENS) -> int:
+    return max(total - estimate_tokens(fixed_text), CHAT_MIN_HISTORY_TOKENS)
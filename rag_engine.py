@@ -1,46 +1,299 @@
-import os
-import faiss
-import requests
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from dotenv import load_dotenv
-
-load_dotenv()
-
-DEFAULT_DOC_ID = os.getenv("GOOGLE_DOC_ID")
-
-class RagEngine:
-    def __init__(self, doc_id: str = DEFAULT_DOC_ID):
-        self.embedder = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        self.dimension = 384
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.chunks = []
-
-        if doc_id:
-            self.load_from_google_doc(doc_id)
-
-    def load_from_google_doc(self, doc_id: str):
-        url = f"https://docs.google.com/document/d/{doc_id}/export?format=txt"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            text = response.text
-            self.chunks = [t.strip() for t in text.split('\n\n') if len(t.strip()) > 10]
-            if self.chunks:
-                embeddings = self.embedder.encode(self.chunks)
-                self.index.add(np.array(embeddings).astype('float32'))
-        except Exception as e:
-            print(f"{e}")
-
-    def search(self, query: str, k: int = 2) -> str:
-        if not self.chunks or self.index.ntotal == 0:
-            return ""
-        query_vec = self.embedder.encode([query])
-        distances, indices = self.index.search(np.array(query_vec).astype('float32'), k)
-        results = []
-        for idx in indices[0]:
-            if idx != -1 and idx < len(self.chunks):
-                results.append(self.chunks[idx])
-        return "\n---\n".join(results)
-
-rag = RagEngine()
\ No newline at end of file
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
+import faiss
+import requests
+import numpy as np
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from metrics import track
+from embeddings import EMBED_BATCH_MAX, EmbeddingBatcher, create_backend, embedding_key
+from vector_index import (IndexConfig, build_index, configure_search, has_ids, prepare_vectors, read_index,
+                          update_index, vector_ids)
+
+load_dotenv()
+
+DEFAULT_DOC_ID = os.getenv("GOOGLE_DOC_ID")
+EMBEDDING_KEY = embedding_key()
+RAG_CACHE_DIR = os.getenv("RAG_CACHE_DIR", ".rag_cache")
+# Tryb wielu workerów: jeden zapisuje indeks, pozostałe mapują go z dysku (mmap) zamiast trzymać własne kopie.
+RAG_SHARED = os.getenv("RAG_SHARED", "0") == "1"
+
+
+def chunk_hash(text: str, model_name: str = EMBEDDING_KEY) -> str:
+    return hashlib.sha256(f"{model_name}\n{text}".encode("utf-8")).hexdigest()
+
+
+def split_chunks(text: str) -> list:
+    return [t.strip() for t in text.split('\n\n') if len(t.strip()) > 10]
+
+
+@dataclass(frozen=True)
+class RagSnapshot:
+    # Niezmienny stan indeksu - search() czyta jedną referencję, a odświeżenie podmienia ją w całości.
+    index: object
+    config: IndexConfig
+    hashes: tuple = ()
+    texts: dict = field(default_factory=dict)
+    meta: dict = field(default_factory=dict)
+
+
+class RagEngine:
+    def __init__(self, doc_id: str = DEFAULT_DOC_ID, cache_dir: str = RAG_CACHE_DIR,
+                 index_config: IndexConfig | None = None):
+        # Model embeddingów ładujemy dopiero w warm_up() (albo przy pierwszym kodowaniu), nie przy imporcie.
+        self.embedder = None
+        self.batcher = None
+        self.dimension = None
+        self.index_config = index_config or IndexConfig()
+        self.snapshot = RagSnapshot(index=None, config=self.index_config)
+        self.cache_dir = cache_dir
+        self.embedding_cache = None
+        self.loaded_version = None
+        self.write_lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+        if doc_id:
+            self.load_from_google_doc(doc_id)
+
+    def warm_up(self):
+        if self.embedder is not None:
+            return
+        with self.load_lock:
+            if self.embedder is not None:
+                return
+            backend = create_backend()
+            # Sidecar sam łączy zapytania wszystkich workerów - lokalne czekanie tylko dodałoby opóźnienie.
+            self.batcher = EmbeddingBatcher(backend, max_batch=1 if backend.name == "sidecar" else EMBED_BATCH_MAX)
+            self.dimension = backend.dimension
+            self.embedder = backend
+            print(f"🧠 RAG: Model embeddingów gotowy ({backend.name}, wymiar {self.dimension}).")
+
+    @property
+    def ready(self) -> bool:
+        return self.embedder is not None and self.snapshot.index is not None
+
+    @property
+    def chunks(self) -> list:
+        snapshot = self.snapshot
+        return [snapshot.texts[i] for i in vector_ids(list(snapshot.hashes)).tolist()]
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def _load_embedding_cache(self) -> dict:
+        path = self._cache_path("embeddings.npz")
+        if not self.cache_dir or not os.path.exists(path):
+            return {}
+        try:
+            data = np.load(path, allow_pickle=False)
+            return {str(h): v for h, v in zip(data["hashes"], data["vectors"])}
+        except Exception as e:
+            print(f"⚠️ RAG: Nie można wczytać cache embeddingów: {e}")
+            return {}
+
+    def _save_cache(self, snapshot: RagSnapshot):
+        if not self.cache_dir or snapshot.index is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            hashes = list(snapshot.hashes)
+            live = {h: self.embedding_cache[h] for h in hashes if h in self.embedding_cache}
+            vectors = np.array(list(live.values()), dtype="float32").reshape(-1, self.dimension)
+
+            tmp = self._cache_path("embeddings.tmp.npz")
+            np.savez(tmp, hashes=np.array(list(live.keys()), dtype=str), vectors=vectors)
+            os.replace(tmp, self._cache_path("embeddings.npz"))
+
+            # Każda wersja indeksu ma własny plik, a chunks.json wskazuje aktualną - proces czytający nigdy
+            # nie zobaczy nowego indeksu ze starą listą fragmentów.
+            previous = self._persisted_index_file()
+            index_file = f"index.{time.time_ns():x}.faiss"
+            tmp = self._cache_path(index_file + ".tmp")
+            faiss.write_index(snapshot.index, tmp)
+            os.replace(tmp, self._cache_path(index_file))
+
+            tmp = self._cache_path("chunks.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({**snapshot.meta, "model": EMBEDDING_KEY, "index": snapshot.config.signature(),
+                           "index_file": index_file, "hashes": hashes,
+                           "chunks": [snapshot.texts[i] for i in vector_ids(hashes).tolist()]},
+                          f, ensure_ascii=False)
+            os.replace(tmp, self._cache_path("chunks.json"))
+            self._remove_stale_indexes({index_file, previous})
+        except Exception as e:
+            print(f"⚠️ RAG: Nie można zapisać cache: {e}")
+
+    def _persisted_index_file(self) -> str | None:
+        try:
+            with open(self._cache_path("chunks.json"), encoding="utf-8") as f:
+                return json.load(f).get("index_file", "index.faiss")
+        except (OSError, ValueError):
+            return None
+
+    def _remove_stale_indexes(self, keep: set):
+        # Poprzednią wersję zostawiamy dla procesów, które właśnie ją otwierają; zmapowany plik można usunąć bezpiecznie.
+        for path in glob.glob(self._cache_path("index.*faiss")):
+            if os.path.basename(path) not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def persisted_version(self) -> int | None:
+        try:
+            return os.stat(self._cache_path("chunks.json")).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_persisted_index(self, mmap: bool = False) -> bool:
+        chunks_path = self._cache_path("chunks.json")
+        if not self.cache_dir or not os.path.exists(chunks_path):
+            return False
+        try:
+            version = self.persisted_version()
+            with open(chunks_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model") != EMBEDDING_KEY or "index" not in meta:
+                return False
+            saved = IndexConfig(**meta["index"])
+            config = self.index_config.resolve(len(meta["chunks"]))
+            if not config.compatible(saved):
+                return False
+            index_path = self._cache_path(meta.get("index_file", "index.faiss"))
+            if not os.path.exists(index_path):
+                return False
+            index = read_index(index_path, saved, mmap=mmap)
+            if index.ntotal != len(meta["chunks"]) or index.d != self.dimension:
+                return False
+            if not has_ids(index):
+                return False
+            config = IndexConfig(**{**meta["index"], "nprobe": config.nprobe, "ef_search": config.ef_search})
+            configure_search(index, config)
+            self.snapshot = RagSnapshot(
+                index=index, config=config, hashes=tuple(meta["hashes"]),
+                texts=dict(zip(vector_ids(meta["hashes"]).tolist(), meta["chunks"])),
+                meta={k: v for k, v in meta.items() if k not in ("model", "index", "index_file", "hashes", "chunks")}
+            )
+            self.loaded_version = version
+            return True
+        except Exception as e:
+            print(f"⚠️ RAG: Uszkodzony cache indeksu: {e}")
+            return False
+
+    def restore(self, mmap: bool = False) -> dict | None:
+        self.warm_up()
+        with self.write_lock:
+            if not self._load_persisted_index(mmap=mmap):
+                return None
+        print(f"📦 RAG: Wczytano indeks z dysku ({len(self.snapshot.hashes)} fragmentów{', mmap' if mmap else ''}).")
+        return self.snapshot.meta
+
+    def reload_if_changed(self) -> bool:
+        # Dla procesów tylko czytających wspólny indeks: podmiana, gdy zapisujący opublikował nową wersję.
+        version = self.persisted_version()
+        if version is None or version == self.loaded_version:
+            return False
+        return self.restore(mmap=True) is not None
+
+    def load_chunks(self, chunks: list, meta: dict | None = None) -> dict:
+        # Różnica względem działającego indeksu po hashach: kodujemy i dokładamy tylko nowe fragmenty,
+        # usuwamy zniknięte, a gotowy indeks podmieniamy jednym przypisaniem - search() nigdy nie czeka.
+        self.warm_up()
+        chunks = list(dict.fromkeys(chunks))
+        hashes = [chunk_hash(c) for c in chunks]
+        with self.write_lock:
+            current = self.snapshot
+            meta = current.meta if meta is None else meta
+            if self.embedding_cache is None:
+                self.embedding_cache = self._load_embedding_cache()
+            known, wanted = set(current.hashes), set(hashes)
+            added = [(h, c) for h, c in zip(hashes, chunks) if h not in known]
+            removed = [h for h in current.hashes if h not in wanted]
+            stats = {"chunks": len(chunks), "added": len(added), "removed": len(removed), "rebuilt": False}
+            if not added and not removed and current.index is not None:
+                if meta != current.meta or tuple(hashes) != current.hashes:
+                    self.snapshot = RagSnapshot(current.index, current.config, tuple(hashes), current.texts, meta)
+                    self._save_cache(self.snapshot)
+                return stats
+
+            missing = [(h, c) for h, c in added if h not in self.embedding_cache]
+            if missing:
+                vectors = self.encode([c for _, c in missing])
+                for (h, _), vec in zip(missing, vectors):
+                    self.embedding_cache[h] = vec
+            print(f"🧮 RAG: Zakodowano {len(missing)}/{len(chunks)} fragmentów (reszta z cache).")
+
+            added_ids, removed_ids = vector_ids([h for h, _ in added]), vector_ids(removed)
+            dropped = set(removed_ids.tolist())
+            texts = {i: t for i, t in current.texts.items() if i not in dropped}
+            texts.update(zip(added_ids.tolist(), [c for _, c in added]))
+
+            config = self.index_config.resolve(len(chunks))
+            index = None
+            if current.hashes and config.compatible(current.config):
+                add_vectors = np.array([self.embedding_cache[h] for h, _ in added], dtype="float32")
+                index = update_index(current.index, current.config, add_vectors.reshape(-1, self.dimension),
+                                     added_ids, removed_ids)
+                config = current.config
+            if index is None:
+                vectors = np.array([self.embedding_cache[h] for h in hashes], dtype="float32")
+                index, config = build_index(vectors.reshape(-1, self.dimension), self.dimension, self.index_config,
+                                            ids=vector_ids(hashes))
+                stats["rebuilt"] = True
+
+            self.snapshot = RagSnapshot(index, config, tuple(hashes), texts, meta)
+            print(f"🗂️ RAG: Indeks {config.kind}/{config.metric}: +{len(added)} -{len(removed)} "
+                  f"({len(chunks)} fragmentów).")
+            self._save_cache(self.snapshot)
+        return stats
+
+    def load_from_google_doc(self, doc_id: str):
+        url = f"https://docs.google.com/document/d/{doc_id}/export?format=txt"
+        try:
+            response = requests.get(url)
+            response.raise_for_status()
+            text = response.text
+            self.load_chunks(split_chunks(text))
+        except Exception as e:
+            print(f"{e}")
+            self.restore()
+
+    def encode(self, texts: list) -> np.ndarray:
+        self.warm_up()
+        with track("rag", "embed"):
+            return self.batcher.encode(texts)
+
+    def try_encode(self, texts: list) -> np.ndarray | None:
+        # Bez czekania na model - przed rozgrzaniem cache odpowiedzi działa tylko na dokładnych dopasowaniach.
+        return self.encode(texts) if self.embedder is not None else None
+
+    def retrieve(self, query: str, k: int = 2) -> tuple[str, np.ndarray | None]:
+        # Jeden wektor zapytania dla wyszukiwania i cache odpowiedzi - kodujemy raz (wołane z puli wątków).
+        vectors = self.try_encode([query])
+        return self.search(query, k, vectors), (vectors[0] if vectors is not None else None)
+
+    def search(self, query: str, k: int = 2, query_vectors: np.ndarray | None = None) -> str:
+        # Dopóki indeks się nie załadował, czat odpowiada bez kontekstu RAG zamiast czekać na model.
+        snapshot = self.snapshot
+        if not self.ready or not snapshot.texts or snapshot.index.ntotal == 0:
+            return ""
+        if query_vectors is None:
+            query_vectors = self.encode([query])
+        query_vec = prepare_vectors(query_vectors, snapshot.config)
+        with track("rag", "search"):
+            distances, indices = snapshot.index.search(query_vec, k)
+        results = []
+        for idx in indices[0]:
+            if idx != -1 and int(idx) in snapshot.texts:
+                results.append(snapshot.texts[int(idx)])
+        return "\n---\n".join(results)
+
+rag = RagEngine(doc_id=None)
@@ -0,0 +1,163 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "900"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.93"))
+RESPONSE_CACHE_HISTORY_MESSAGES = int(os.getenv("RESPONSE_CACHE_HISTORY_MESSAGES", "6"))
+
+# Pytania nawiązujące do rozmowy ("tak", "a ta druga?") mają sens tylko z historią danej sesji.
+FOLLOW_UP_WORDS = {
+    "tak", "nie", "ok", "okej", "a", "i", "ten", "ta", "to", "te", "tę", "tego", "tej", "tym", "go", "ją", "ja", "jej",
+    "jego", "nich", "nim", "niej", "ich", "one", "oni", "on", "ona", "drugi", "druga", "drugie", "pierwszy",
+    "pierwsza", "pierwsze", "poprzedni", "poprzednia", "poprzednie", "tamten", "tamta", "tamto", "obu", "oba", "który",
+    "która", "które", "wtedy", "też", "tez", "jeszcze", "więcej", "wiecej", "dalej", "inny", "inna", "inne",
+}
+MIN_STANDALONE_WORDS = 4
+
+
+def normalize_text(text: str) -> str:
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+@dataclass
+class CacheEntry:
+    response: str
+    product: str
+    rag_hash: str
+    vector: np.ndarray | None
+    created_at: float = field(default_factory=time.monotonic)
+    products: set = field(default_factory=set)
+    standalone: bool = False
+    tokens: frozenset = frozenset()
+
+
+def is_standalone(message: str, history: list) -> bool:
+    if not history:
+        return True
+    words = normalize_text(message).split()
+    return len(words) >= MIN_STANDALONE_WORDS and not FOLLOW_UP_WORDS.intersection(words)
+
+
+def product_tokens(message: str) -> frozenset:
+    # Nazwy i modele ("iPhone 15", "XM5", "Galaxy") - podobieństwo wektorów ich nie rozróżnia, więc muszą się zgadzać dokładnie.
+    words = re.findall(r"[\w\-+]+", message or "")
+    return frozenset(w.lower() for i, w in enumerate(words)
+                     if any(c.isdigit() for c in w) or any(c.isupper() for c in w[1:]) or (i and w[:1].isupper()))
+
+
+def history_digest(history: list, limit: int = RESPONSE_CACHE_HISTORY_MESSAGES) -> str:
+    recent = history[-limit:] if limit else history
+    payload = "\x00".join(f"{m.role}:{normalize_text(m.content)}" for m in recent)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Wektor zapytania liczy wołający (razem z wyszukiwaniem RAG w puli wątków) - cache nie koduje na pętli zdarzeń.
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL_S,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _key(self, message: str, product: str | None, rag_context: str, history: list) -> tuple[str, str, str, bool]:
+        norm_msg = normalize_text(message)
+        norm_product = normalize_text(product)
+        rag_hash = hashlib.sha256((rag_context or "").encode("utf-8")).hexdigest()
+        standalone = is_standalone(message, history)
+        history_key = "" if standalone else history_digest(history)
+        key = hashlib.sha256(f"{norm_msg}\x00{norm_product}\x00{rag_hash}\x00{history_key}".encode("utf-8")).hexdigest()
+        return key, norm_product, rag_hash, standalone
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray | None:
+        if vector is None:
+            return None
+        vec = np.asarray(vector, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl
+
+    def get(self, message: str, product: str | None, rag_context: str, history: list = None,
+            vector: np.ndarray | None = None) -> str | None:
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+        history = history or []
+        key, norm_product, rag_hash, standalone = self._key(message, product, rag_context, history)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and not self._expired(entry):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry.response
+            if entry:
+                del self.entries[key]
+            query_vec = self._normalize(vector) if standalone else None
+            tokens = product_tokens(message)
+            candidates = [] if query_vec is None else [
+                (k, e) for k, e in self.entries.items()
+                if e.vector is not None and e.standalone and e.product == norm_product and e.rag_hash == rag_hash
+                and e.tokens == tokens and e.vector.shape == query_vec.shape
+            ]
+        if not candidates:
+            self.misses += 1
+            return None
+
+        scores = np.stack([e.vector for _, e in candidates]) @ query_vec
+        best = int(np.argmax(scores))
+        best_key, best_entry = candidates[best]
+        with self.lock:
+            if scores[best] < self.similarity or best_key not in self.entries or self._expired(best_entry):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            return best_entry.response
+
+    def put(self, message: str, product: str | None, rag_context: str, response: str, related_products: list = None,
+            history: list = None, vector: np.ndarray | None = None):
+        if not RESPONSE_CACHE_ENABLED or not response:
+            return
+        key, norm_product, rag_hash, standalone = self._key(message, product, rag_context, history or [])
+        products = {p for p in [norm_product] + [normalize_text(p) for p in related_products or []] if p}
+        entry = CacheEntry(response=response, product=norm_product, rag_hash=rag_hash,
+                           vector=self._normalize(vector) if standalone else None, products=products,
+                           standalone=standalone, tokens=product_tokens(message))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate_product(self, product_name: str) -> int:
+        norm_product = normalize_text(product_name)
+        if not norm_product:
+            return 0
+        with self.lock:
+            stale = [k for k, e in self.entries.items()
+                     if any(norm_product in p or p in norm_product for p in e.products)]
+            for k in stale:
+                del self.entries[k]
+        return len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,75 @@
+import os
+import re
+import hashlib
+from collections import defaultdict
+
+REVIEW_DEDUP_THRESHOLD = float(os.getenv("REVIEW_DEDUP_THRESHOLD", "0.7"))
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+
+_rng = [int.from_bytes(hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest(), "big")
+        for i in range(MINHASH_PERMUTATIONS)]
+_PERMUTATIONS = [((r >> 64) % (_PRIME - 1) + 1, (r & _MASK) % _PRIME) for r in _rng]
+
+
+def normalize_review(text: str) -> str:
+    # Scraper dokleja tytuł strony "[...]" - ten sam snippet z różnych źródeł ma różne tytuły.
+    text = re.sub(r"^\s*\[[^\]]*\]\s*", "", text or "")
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def shingles(text: str, k: int = 3) -> set:
+    words = text.split()
+    if len(words) < k:
+        return {text[i:i + 5] for i in range(max(1, len(text) - 4))}
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def minhash(items: set) -> tuple:
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in items]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def estimated_similarity(sig_a: tuple, sig_b: tuple) -> float:
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / len(sig_a)
+
+
+def dedupe_reviews(reviews: list[dict], threshold: float = REVIEW_DEDUP_THRESHOLD) -> list[dict]:
+    # Dokładne duplikaty łączymy po znormalizowanym tekście, bliskie - przez MinHash + LSH.
+    # Zostaje najdłuższa wersja z licznikiem `duplicates` dla całego klastra.
+    clusters: list[dict] = []
+    by_text: dict[str, int] = {}
+    signatures: list[tuple] = []
+    buckets = defaultdict(list)
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+
+    for review in reviews:
+        norm = normalize_review(review.get("content", ""))
+        if not norm:
+            continue
+        count = review.get("duplicates", 1)
+        match = by_text.get(norm)
+        if match is None:
+            sig = minhash(shingles(norm))
+            candidates = {c for band in range(LSH_BANDS)
+                          for c in buckets[(band, sig[band * rows:(band + 1) * rows])]}
+            scored = [(estimated_similarity(sig, signatures[c]), c) for c in candidates]
+            best = max(scored, default=(0.0, None))
+            if best[0] >= threshold:
+                match = best[1]
+            else:
+                match = len(clusters)
+                clusters.append(dict(review, duplicates=0))
+                signatures.append(sig)
+                for band in range(LSH_BANDS):
+                    buckets[(band, sig[band * rows:(band + 1) * rows])].append(match)
+            by_text[norm] = match
+
+        cluster = clusters[match]
+        cluster["duplicates"] += count
+        if len(review.get("content", "")) > len(cluster.get("content", "")):
+            cluster.update({k: v for k, v in review.items() if k != "duplicates"})
+    return clusters
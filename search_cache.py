@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import threading
+import concurrent.futures
+from datetime import datetime, timedelta
+from sqlmodel import Session
+from database import engine
+from models import SearchCacheEntry
+from metrics import count
+from scraper import fetch_shopping_results, get_mock_search_results, serp_api_key
+
+SEARCH_CACHE_TTL_S = float(os.getenv("SEARCH_CACHE_TTL_S", "3600"))
+SEARCH_CACHE_STALE_S = float(os.getenv("SEARCH_CACHE_STALE_S", "86400"))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class SearchCache:
+    # Świeże wpisy zwracamy od razu, przeterminowane (ale w oknie "stale") też, odświeżając je w tle.
+    # Równoległe identyczne zapytania czekają na jedno wywołanie SerpApi.
+    def __init__(self, fetcher, ttl_s: float = SEARCH_CACHE_TTL_S, stale_s: float = SEARCH_CACHE_STALE_S):
+        self.fetcher = fetcher
+        self.ttl = timedelta(seconds=ttl_s)
+        self.stale = timedelta(seconds=stale_s)
+        self.in_flight: dict[str, concurrent.futures.Future] = {}
+        self.lock = threading.Lock()
+        self.refresher = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-refresh")
+
+    @staticmethod
+    def make_key(query: str, gl: str, hl: str) -> str:
+        return hashlib.sha256(f"{normalize_query(query)}|{gl}|{hl}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, gl: str = "pl", hl: str = "pl") -> list:
+        key = self.make_key(query, gl, hl)
+        with Session(engine) as session:
+            entry = session.get(SearchCacheEntry, key)
+        if entry:
+            age = datetime.utcnow() - entry.fetched_at
+            if age < self.ttl:
+                return json.loads(entry.results)
+            if age < self.ttl + self.stale:
+                if key not in self.in_flight:
+                    self.refresher.submit(self._refresh, key, query, gl, hl)
+                return json.loads(entry.results)
+        return self._fetch(key, query, gl, hl)
+
+    def _refresh(self, key: str, query: str, gl: str, hl: str):
+        # Wyjątek z puli w tle nikt by nie odebrał - logujemy go i liczymy zamiast gubić.
+        try:
+            self._fetch(key, query, gl, hl)
+            count("search_cache", "refresh", "ok")
+        except Exception as e:
+            print(f"⚠️ Cache wyszukiwania: Odświeżenie '{query}' nie powiodło się: {e!r}")
+            count("search_cache", "refresh", "refresh_error")
+
+    def _fetch(self, key: str, query: str, gl: str, hl: str) -> list:
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.in_flight[key] = future
+        if not owner:
+            return future.result()
+
+        try:
+            results = self.fetcher(query, gl, hl)
+            self._store(key, query, gl, hl, results)
+            future.set_result(results)
+            return results
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def _store(self, key: str, query: str, gl: str, hl: str, results: list):
+        try:
+            with Session(engine) as session:
+                entry = session.get(SearchCacheEntry, key) or SearchCacheEntry(key=key, query=normalize_query(query),
+                                                                               gl=gl, hl=hl, results="[]")
+                entry.results = json.dumps(results, ensure_ascii=False)
+                entry.fetched_at = datetime.utcnow()
+                session.add(entry)
+                session.commit()
+        except Exception as e:
+            print(f"⚠️ Cache wyszukiwania: Nie udało się zapisać wyników: {e}")
+
+
+search_cache = SearchCache(fetch_shopping_results)
+
+
+def search_products_cached(query: str, gl: str = "pl", hl: str = "pl") -> list:
+    if not serp_api_key():
+        return get_mock_search_results(query)
+    try:
+        products = search_cache.get(query, gl, hl)
+    except Exception as e:
+        print(f"{e}")
+        products = []
+    return products if products else get_mock_search_results(query)
@@ -19,20 +19,48 @@ class SecurityGuard:
             "system prompt"
         ]
 
+        self.injection_phrases = ["ignore previous", "zapomnij instrukcje", "system prompt", "reveal"]
+        self.path_patterns = [r"\.\./", r"\.\.\\", r"/etc/", r"C:\\Windows"]
+        self.compile()
+
+    def compile(self):
+        # Wszystko przygotowane raz: frazy małymi literami (szukane na jednej kopii tekstu po lower()),
+        # wyrażenia regularne skompilowane zamiast re.sub/re.search z napisem przy każdym wywołaniu.
+        self.leak_phrases = tuple(p.lower() for p in self.forbidden_phrases)
+        self.injection_phrases_lower = tuple(p.lower() for p in self.injection_phrases)
+        self.secret_res = [re.compile(p) for p in self.secret_patterns]
+        self.path_re = re.compile("|".join(self.path_patterns))
+        self.max_phrase_len = max(len(p) for p in self.leak_phrases)
+
+    @staticmethod
+    def _has_phrase(text_lower: str, phrases: tuple) -> bool:
+        return any(p in text_lower for p in phrases)
+
+    def scan_output(self, text: str) -> tuple[bool, str]:
+        if not text:
+            return False, text
+        if self._has_phrase(text.lower(), self.leak_phrases):
+            return True, ""
+        return False, self.sanitize_output(text)
+
+    def check_input(self, text: str) -> Optional[str]:
+        if not text:
+            return None
+        if self.path_re.search(text):
+            return "path"
+        if self._has_phrase(text.lower(), self.injection_phrases_lower):
+            return "injection"
+        return None
+
     def sanitize_output(self, text: str) -> str:
-        cleaned_text = text
-        for pattern in self.secret_patterns:
-            cleaned_text = re.sub(pattern, "[REDACTED_SECRET]", cleaned_text)
-        return cleaned_text
+        for secret_re in self.secret_res:
+            text = secret_re.sub("[REDACTED_SECRET]", text)
+        return text
 
     def check_prompt_leakage(self, text: str) -> bool:
         if not text:
             return False
-        text_lower = text.lower()
-        for phrase in self.forbidden_phrases:
-            if phrase.lower() in text_lower:
-                return True
-        return False
+        return self._has_phrase(text.lower(), self.leak_phrases)
 
     def validate_json_only(self, text: str) -> Optional[dict]:
         pattern = r"```(?:json)?\s*(.*?)\s*```"
@@ -45,10 +73,66 @@ class SecurityGuard:
             return None
 
     def check_path_traversal(self, text: str) -> bool:
-        dangerous_patterns = [r"\.\./", r"\.\.\\", r"/etc/", r"C:\\Windows"]
-        for pattern in dangerous_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        return self.path_re.search(text) is not None
+
+    def stream(self) -> "StreamGuard":
+        return StreamGuard(self)
+
+
+class StreamGuard:
+    # Przetrzymuje końcówkę strumienia, żeby sekret lub zakazana fraza rozcięta
+    # między tokenami została wykryta, zanim jakakolwiek jej część trafi do klienta.
+    def __init__(self, guard: SecurityGuard, hold: int = 64, max_hold: int = 4096):
+        self.guard = guard
+        self.hold = max(hold, guard.max_phrase_len)
+        self.max_hold = max_hold
+        self.parts = []
+        self.emitted = []
+        self.buffer = ""
+        self.tail = ""
+        self.leaked = False
+
+    def feed(self, chunk: str) -> str:
+        if self.leaked or not chunk:
+            return ""
+        self.parts.append(chunk)
+        # Skanujemy tylko nowy fragment z zakładką na frazę rozciętą między tokenami, a nie cały dotychczasowy tekst.
+        window = self.tail + chunk
+        if self.guard.check_prompt_leakage(window):
+            self.leaked = True
+            self.buffer = ""
+            return ""
+        self.tail = window[-(self.guard.max_phrase_len - 1):]
+
+        self.buffer += chunk
+        cut = len(self.buffer) - self.hold
+        if cut <= 0:
+            return ""
+        # Tniemy na białym znaku, żeby nie rozdzielić sekretu bez stałej długości (np. connection string).
+        boundary = max(self.buffer.rfind(" ", 0, cut), self.buffer.rfind("\n", 0, cut)) + 1
+        if boundary == 0:
+            if len(self.buffer) < self.max_hold:
+                return ""
+            boundary = cut
+        safe = self.guard.sanitize_output(self.buffer[:boundary])
+        self.buffer = self.buffer[boundary:]
+        self.emitted.append(safe)
+        return safe
+
+    def flush(self) -> str:
+        if self.leaked:
+            return ""
+        safe, self.buffer = self.guard.sanitize_output(self.buffer), ""
+        self.emitted.append(safe)
+        return safe
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def output(self) -> str:
+        return "".join(self.emitted)
+
 
-guard = SecurityGuard()
\ No newline at end of file
+guard = SecurityGuard()
@@ -1,105 +1,230 @@
-from pydantic import BaseModel, Field, ValidationError
-from sqlmodel import Session, select
-from models import Product, Offer, Insight
-from database import engine
-import json
-import concurrent.futures
-import functools
-
-MAX_TEXT_LENGTH = 500
-
-def with_timeout(seconds: int):
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            try:
-                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(func, *args, **kwargs)
-                    return future.result(timeout=seconds)
-            except concurrent.futures.TimeoutError:
-                return json.dumps(
-                    {"status": "error", "code": "TIMEOUT", "message": f"Przekroczono czas operacji ({seconds}s)."})
-            except ValidationError as ve:
-                return json.dumps({"status": "error", "code": "VALIDATION_ERROR", "message": str(ve)})
-            except Exception as e:
-                return json.dumps({"status": "error", "code": "TOOL_ERROR", "message": str(e)})
-        return wrapper
-    return decorator
-
-class ProductInput(BaseModel):
-    product_name: str = Field(..., description="Nazwa produktu, o który pyta użytkownik")
-
-class InstallmentInput(BaseModel):
-    price: float = Field(..., gt=0)
-    months: int = Field(..., ge=3, le=48)
-
-@with_timeout(5)
-def tool_get_product_details(args: dict) -> str:
-        if isinstance(args, str):
-            try:
-                args = json.loads(args)
-            except json.JSONDecodeError:
-                return json.dumps({"status": "error", "code": "VALIDATION_ERROR", "message": "Argumenty nie są JSONem"})
-        params = ProductInput(**args)
-        search_term = params.product_name.strip()
-        with Session(engine) as session:
-            statement = select(Product).where(Product.name.ilike(f"%{search_term}%")).order_by(Product.id.desc())
-            prod = session.exec(statement).first()
-            if not prod:
-                return json.dumps({"status": "error", "code": "NOT_FOUND", "message": f"Nie znaleziono produktu '{search_term}'."})
-            offers = session.exec(select(Offer).where(Offer.product_id == prod.id)).all()
-            insight = session.exec(select(Insight).where(Insight.product_id == prod.id)).first()
-
-            summary_text = (insight.summary[:MAX_TEXT_LENGTH] + "...") if insight and insight.summary and len(
-                insight.summary) > MAX_TEXT_LENGTH else (insight.summary if insight else "Brak analizy.")
-
-            data = {
-                "type": "product_report",
-                "id": prod.id,
-                "name": prod.name,
-                "price": float(prod.price),
-                "image": prod.image_url,
-                "summary": summary_text,
-                "pros": insight.pros if insight else "Brak danych.",
-                "cons": insight.cons if insight else "Brak danych.",
-
-
-                "system_info": f"""
-                            TO SĄ FAKTY Z BAZY DANYCH O {prod.name}:
-                            - Cena: {prod.price} zł
-                            - Główne zalety z opinii: {insight.pros if insight else 'brak'}
-                            - Główne wady z opinii: {insight.cons if insight else 'brak'}
-                            Jeśli użytkownik pyta o te rzeczy, CYTUJ TE DANE.
-                            Jeśli pyta o parametry techniczne (ekran, bateria), użyj swojej wiedzy.
-                            """,
-                
-
-                "offers": [
-                    {"store": o.store_name, "link": o.link.strip().replace("\n", ""), "price": float(o.price)}
-                    for o in offers
-                ]
-            }
-            return json.dumps(data, ensure_ascii=False)
-
-
-@with_timeout(1)
-def tool_calculate_installment(args: dict) -> str:
-    if isinstance(args, str):
-        try: args = json.loads(args)
-        except: pass
-        params = InstallmentInput(**args)
-        monthly = params.price / params.months
-        return json.dumps({
-            "status": "success",
-            "details": f"Rata: {monthly:.2f} zł miesięcznie ({params.months} rat) dla kwoty {params.price} zł."
-        }, ensure_ascii=False)
-
-TOOLS_MAP = {
-    "get_product_details": tool_get_product_details,
-    "calculate_installment": tool_calculate_installment
-}
-TOOLS_DESC = """
-DOSTĘPNE NARZĘDZIA:
-1. get_product_details(product_name: str) - Użyj ZAWSZE, gdy użytkownik pyta o cenę, zdjęcie, linki, zalety, wady lub chce poznać szczegóły zaimportowanego produktu.
-2. calculate_installment(price: float, months: int) - Użyj do obliczeń ratalnych.
+from pydantic import BaseModel, Field, ValidationError
+from sqlmodel import Session
+from database import engine_with_timeout
+from product_repository import find_product_report
+from collections import deque
+import os
+import json
+import time
+import asyncio
+import threading
+import concurrent.futures
+import functools
+from metrics import observe, count
+
+MAX_TEXT_LENGTH = 500
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "8"))
+TOOL_MAX_QUEUE = int(os.getenv("TOOL_MAX_QUEUE", "32"))
+
+
+class ToolBusyError(Exception):
+    pass
+
+
+class ToolStats:
+    def __init__(self, window: int = 200):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+
+    def percentile(self, p: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class ToolExecutor:
+    # Jedna, długo żyjąca pula wątków dla wszystkich narzędzi. Kolejka jest ograniczona,
+    # a po przekroczeniu limitu czasu wywołujący dostaje odpowiedź od razu.
+    def __init__(self, max_workers: int = TOOL_MAX_WORKERS, max_queue: int = TOOL_MAX_QUEUE):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.stats: dict[str, ToolStats] = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, name: str) -> ToolStats:
+        with self.lock:
+            return self.stats.setdefault(name, ToolStats())
+
+    def submit(self, name: str, func, *args, **kwargs) -> concurrent.futures.Future:
+        stats = self._stats(name)
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                stats.rejected += 1
+            count("tool", name, "rejected")
+            raise ToolBusyError(f"Kolejka narzędzi jest pełna ({name}).")
+        start = time.perf_counter()
+
+        def run():
+            with self.lock:
+                stats.in_flight += 1
+            ok = False
+            try:
+                result = func(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                observe("tool", name, elapsed, ok)
+                with self.lock:
+                    stats.in_flight -= 1
+                    stats.latencies.append(elapsed)
+
+        with self.lock:
+            stats.calls += 1
+        future = self.pool.submit(run)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def record_failure(self, name: str, timeout: bool = False):
+        stats = self._stats(name)
+        if timeout:
+            count("tool", name, "timeout")
+        with self.lock:
+            if timeout:
+                stats.timeouts += 1
+            else:
+                stats.errors += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                name: {
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "timeouts": s.timeouts,
+                    "rejected": s.rejected,
+                    "in_flight": s.in_flight,
+                    "p50_s": s.percentile(50),
+                    "p95_s": s.percentile(95),
+                }
+                for name, s in self.stats.items()
+            }
+
+
+tool_executor = ToolExecutor()
+
+
+def _tool_error(name: str, e: Exception, seconds: int) -> str:
+    if isinstance(e, (concurrent.futures.TimeoutError, asyncio.TimeoutError)):
+        tool_executor.record_failure(name, timeout=True)
+        return json.dumps(
+            {"status": "error", "code": "TIMEOUT", "message": f"Przekroczono czas operacji ({seconds}s)."})
+    tool_executor.record_failure(name)
+    if isinstance(e, ToolBusyError):
+        return json.dumps({"status": "error", "code": "BUSY", "message": str(e)})
+    if isinstance(e, ValidationError):
+        return json.dumps({"status": "error", "code": "VALIDATION_ERROR", "message": str(e)})
+    return json.dumps({"status": "error", "code": "TOOL_ERROR", "message": str(e)})
+
+
+def with_timeout(seconds: int):
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            future = None
+            try:
+                future = tool_executor.submit(name, func, *args, **kwargs)
+                return future.result(timeout=seconds)
+            except Exception as e:
+                if future is not None:
+                    future.cancel()
+                return _tool_error(name, e, seconds)
+
+        async def arun(*args, **kwargs):
+            future = None
+            try:
+                future = tool_executor.submit(name, func, *args, **kwargs)
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout=seconds)
+            except Exception as e:
+                if future is not None:
+                    future.cancel()
+                return _tool_error(name, e, seconds)
+
+        wrapper.timeout = seconds
+        wrapper.arun = arun
+        return wrapper
+    return decorator
+
+
+class ProductInput(BaseModel):
+    product_name: str = Field(..., description="Nazwa produktu, o który pyta użytkownik")
+
+class InstallmentInput(BaseModel):
+    price: float = Field(..., gt=0)
+    months: int = Field(..., ge=3, le=48)
+
+@with_timeout(5)
+def tool_get_product_details(args: dict) -> str:
+        if isinstance(args, str):
+            try:
+                args = json.loads(args)
+            except json.JSONDecodeError:
+                return json.dumps({"status": "error", "code": "VALIDATION_ERROR", "message": "Argumenty nie są JSONem"})
+        params = ProductInput(**args)
+        search_term = params.product_name.strip()
+        # Wątku nie da się przerwać, ale Postgres sam anuluje zapytanie po przekroczeniu limitu (opcja połączenia).
+        with Session(engine_with_timeout(tool_get_product_details.timeout)) as session:
+            prod = find_product_report(session, search_term)
+            if not prod:
+                return json.dumps({"status": "error", "code": "NOT_FOUND", "message": f"Nie znaleziono produktu '{search_term}'."})
+
+        summary_text = (prod.summary[:MAX_TEXT_LENGTH] + "...") if prod.summary and len(
+            prod.summary) > MAX_TEXT_LENGTH else (prod.summary if prod.has_insight else "Brak analizy.")
+
+        data = {
+            "type": "product_report",
+            "id": prod.id,
+            "name": prod.name,
+            "price": prod.price,
+            "image": prod.image_url,
+            "summary": summary_text,
+            "pros": prod.pros if prod.has_insight else "Brak danych.",
+            "cons": prod.cons if prod.has_insight else "Brak danych.",
+
+
+            "system_info": f"""
+                            TO SĄ FAKTY Z BAZY DANYCH O {prod.name}:
+                            - Cena: {prod.price} zł
+                            - Główne zalety z opinii: {prod.pros if prod.has_insight else 'brak'}
+                            - Główne wady z opinii: {prod.cons if prod.has_insight else 'brak'}
+                            Jeśli użytkownik pyta o te rzeczy, CYTUJ TE DANE.
+                            Jeśli pyta o parametry techniczne (ekran, bateria), użyj swojej wiedzy.
+                            """,
+
+
+            "offers": [
+                {"store": o.store_name, "link": (o.link or "").strip().replace("\n", ""), "price": o.price}
+                for o in prod.offers
+            ]
+        }
+        return json.dumps(data, ensure_ascii=False)
+
+
+@with_timeout(1)
+def tool_calculate_installment(args: dict) -> str:
+    if isinstance(args, str):
+        try: args = json.loads(args)
+        except: pass
+    params = InstallmentInput(**args)
+    monthly = params.price / params.months
+    return json.dumps({
+        "status": "success",
+        "details": f"Rata: {monthly:.2f} zł miesięcznie ({params.months} rat) dla kwoty {params.price} zł."
+    }, ensure_ascii=False)
+
+TOOLS_MAP = {
+    "get_product_details": tool_get_product_details,
+    "calculate_installment": tool_calculate_installment
+}
+TOOLS_DESC = """
+DOSTĘPNE NARZĘDZIA:
+1. get_product_details(product_name: str) - Użyj ZAWSZE, gdy użytkownik pyta o cenę, zdjęcie, linki, zalety, wady lub chce poznać szczegóły zaimportowanego produktu.
+2. calculate_installment(price: float, months: int) - Użyj do obliczeń ratalnych.
 """
\ No newline at end of file
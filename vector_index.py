@@ -0,0 +1,143 @@
+import os
+import math
+import faiss
+import numpy as np
+from dataclasses import dataclass, replace, asdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "auto")  # auto | flat | ivf | hnsw
+RAG_METRIC = os.getenv("RAG_METRIC", "l2")  # l2 | ip | cosine
+RAG_AUTO_FLAT_MAX = int(os.getenv("RAG_AUTO_FLAT_MAX", "20000"))
+RAG_IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))  # 0 = dobierz do liczby fragmentów
+RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "0"))
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "80"))
+RAG_HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+RAG_TRAIN_SAMPLE = int(os.getenv("RAG_TRAIN_SAMPLE", "100000"))
+
+MIN_POINTS_PER_CENTROID = 39
+
+
+@dataclass(frozen=True)
+class IndexConfig:
+    kind: str = RAG_INDEX_TYPE
+    metric: str = RAG_METRIC
+    nlist: int = RAG_IVF_NLIST
+    nprobe: int = RAG_IVF_NPROBE
+    hnsw_m: int = RAG_HNSW_M
+    ef_construction: int = RAG_HNSW_EF_CONSTRUCTION
+    ef_search: int = RAG_HNSW_EF_SEARCH
+
+    def resolve(self, n: int) -> "IndexConfig":
+        # "auto": płaski indeks jest dokładny i wystarczająco szybki dla małych baz, powyżej progu - HNSW.
+        kind = self.kind
+        if kind == "auto":
+            kind = "flat" if n <= RAG_AUTO_FLAT_MAX else "hnsw"
+        if kind == "ivf" and n < MIN_POINTS_PER_CENTROID:
+            kind = "flat"
+        if kind == "ivf":
+            nlist = self.nlist or max(1, int(4 * math.sqrt(n)))
+            nlist = max(1, min(nlist, n // MIN_POINTS_PER_CENTROID))
+            nprobe = self.nprobe or max(1, min(nlist, nlist // 16 or 1))
+            return replace(self, kind=kind, nlist=nlist, nprobe=nprobe)
+        return replace(self, kind=kind)
+
+    def signature(self) -> dict:
+        return asdict(self)
+
+    def compatible(self, other: "IndexConfig") -> bool:
+        # Czy istniejący indeks (other) można dalej uzupełniać zamiast budować od nowa.
+        if (self.kind, self.metric) != (other.kind, other.metric):
+            return False
+        if self.kind == "ivf":
+            return other.nlist // 2 <= self.nlist <= other.nlist * 2
+        if self.kind == "hnsw":
+            return (self.hnsw_m, self.ef_construction) == (other.hnsw_m, other.ef_construction)
+        return True
+
+    @property
+    def faiss_metric(self) -> int:
+        return faiss.METRIC_L2 if self.metric == "l2" else faiss.METRIC_INNER_PRODUCT
+
+
+def prepare_vectors(vectors: np.ndarray, config: IndexConfig) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if config.metric == "cosine":
+        vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def vector_ids(hashes: list[str]) -> np.ndarray:
+    # Stabilne identyfikatory z hashy fragmentów - ten sam fragment ma to samo id w każdym indeksie.
+    return np.array([int(h[:15], 16) for h in hashes], dtype="int64")
+
+
+def has_ids(index) -> bool:
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexIVF))
+
+
+def base_index(index):
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def configure_search(index, config: IndexConfig):
+    # Parametry wyszukiwania nie zawsze są zapisywane z indeksem - ustawiamy je po zbudowaniu i po wczytaniu.
+    if config.kind == "ivf":
+        faiss.extract_index_ivf(index).nprobe = config.nprobe
+    elif config.kind == "hnsw":
+        base_index(index).hnsw.efSearch = config.ef_search
+
+
+def read_index(path: str, config: IndexConfig, mmap: bool = False):
+    # Przy mmap wektory zostają w pliku - strony są współdzielone przez wszystkie procesy czytające ten sam indeks.
+    # Taki indeks jest tylko do odczytu, więc aktualizacje robi proces, który wczytał go bez mmap.
+    if not mmap:
+        return faiss.read_index(path)
+    flag = faiss.IO_FLAG_MMAP if config.kind == "ivf" else faiss.IO_FLAG_MMAP_IFC
+    return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+
+
+def update_index(index, config: IndexConfig, add_vectors: np.ndarray, add_ids: np.ndarray, remove_ids: np.ndarray):
+    # Kopia działającego indeksu z naniesionymi zmianami; None, gdy typ indeksu nie pozwala usuwać wektorów.
+    if len(remove_ids) and config.kind == "hnsw":
+        return None
+    updated = faiss.clone_index(index)
+    if len(remove_ids):
+        updated.remove_ids(remove_ids)
+    if len(add_ids):
+        updated.add_with_ids(prepare_vectors(add_vectors, config), add_ids)
+    configure_search(updated, config)
+    return updated
+
+
+def build_index(vectors: np.ndarray, dimension: int, config: IndexConfig,
+                ids: np.ndarray | None = None) -> tuple[faiss.Index, IndexConfig]:
+    config = config.resolve(len(vectors))
+    vectors = prepare_vectors(vectors, config).reshape(-1, dimension)
+    if config.kind == "ivf":
+        quantizer = faiss.IndexFlat(dimension, config.faiss_metric)
+        index = faiss.IndexIVFFlat(quantizer, dimension, config.nlist, config.faiss_metric)
+        sample = vectors
+        if len(vectors) > RAG_TRAIN_SAMPLE:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), RAG_TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+    elif config.kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, config.hnsw_m, config.faiss_metric)
+        index.hnsw.efConstruction = config.ef_construction
+    else:
+        index = faiss.IndexFlat(dimension, config.faiss_metric)
+    # IVF przechowuje własne id i umie je usuwać; płaski i HNSW potrzebują mapy id (usuwanie tylko dla płaskiego).
+    if ids is not None and config.kind != "ivf":
+        index = faiss.IndexIDMap2(index)
+    if len(vectors) and ids is not None:
+        index.add_with_ids(vectors, ids)
+    elif len(vectors):
+        index.add(vectors)
+    configure_search(index, config)
+    return index, config